@@ -12,11 +12,9 @@ import json
 import shutil
 import os
 
-from scripts.unzipper import ZipFuncs
-from scripts.processor import ProcessorFuncs
-
-from scripts.topcontactdetails import TopContactDetails
-from scripts.messagesovertime import MessagesOverTime
+from scripts.pipeline import pipeline_stages
+from scripts.scheduler import StageScheduler
+from scripts import instrument
 
 
 if __name__ == "__main__":
@@ -37,27 +35,18 @@ if __name__ == "__main__":
     if config['debug']:
         print("⚠ Debugging... will force re-run all processing")
 
-    print("##############################")
-    print("# Unzipping Data")
-    print("##############################")
-
-    ZipFuncs().run_unzip_process(config)
-
-    print("##############################")
-    print("# Processing Data")
-    print("##############################")
-
-    ProcessorFuncs().run_processing(config)
-
-    print("##############################")
-    print("# Generating Graphs")
-    print("##############################")
-
-    TopContactDetails().generate_all_graphs(config)
+    # Record the time and memory each stage takes
+    run = None
+    if config.get('runReport', True):
+        run = instrument.start_run(config)
 
-    messagesOverTimeConfig = config['messagesOverTime']
+    # Stages run as soon as the stages they depend on are done
+    scheduler = StageScheduler(
+        pipeline_stages(), config.get('stageWorkers', 1))
+    scheduler.run(config)
 
-    MessagesOverTime().make_graphs(config, messagesOverTimeConfig)
+    if run is not None:
+        print("Run report saved to %s" % run.save_report())
 
     print("====================================")
     print("✓ Messenger Analysis Complete")
@@ -0,0 +1,223 @@
+###################################
+# run-benchmarks.py
+###################################
+"""
+Author: Matt Balshaw
+Start Date: 18/10/2026
+
+Times each stage of the analysis on generated exports of several sizes
+Results are saved to benchmark-results/ and compared to the saved
+baseline, so slowdowns show up before they are merged
+
+Usage: python run-benchmarks.py [small medium large] [--save-baseline]
+"""
+
+import json
+import os
+import sys
+import time
+import platform
+import subprocess
+from pathlib import Path
+
+from scripts.synthetic import SyntheticFuncs
+from scripts.unzipper import ZipFuncs
+from scripts.processor import ProcessorFuncs
+from scripts.datastore import DataStoreFuncs
+from scripts.dataset import ProcessedDataset
+from scripts.topcontactdetails import TopContactDetails
+from scripts.messagesovertime import MessagesOverTime
+
+
+# The size of export generated for each scale
+scales = {
+    "small": {
+        "contacts": 20,
+        "messages": 20000,
+        "years": 3,
+        "groupRatio": 0.1
+    },
+    "medium": {
+        "contacts": 100,
+        "messages": 200000,
+        "years": 8,
+        "groupRatio": 0.15
+    },
+    "large": {
+        "contacts": 400,
+        "messages": 1000000,
+        "years": 15,
+        "groupRatio": 0.2
+    }
+}
+
+myName = "Benchmark Me"
+resultsLoc = "benchmark-results/"
+baselineLoc = resultsLoc + "baseline.json"
+
+# Stages this much slower than the baseline are flagged
+slowerBy = 0.1
+
+
+def make_export(scale, params):
+    # Only regenerate the zip if its size settings have changed
+    zipLoc = "facebook-zips/benchmark-" + scale + ".zip"
+    paramsLoc = "facebook-zips/benchmark-" + scale + ".json"
+
+    if os.path.exists(zipLoc) and os.path.exists(paramsLoc):
+        with open(paramsLoc, "r") as f:
+            if json.load(f) == params:
+                print("♻ Using existing %s export" % scale)
+                return
+
+    SyntheticFuncs().make_export(zipLoc, myName, **params)
+
+    with open(paramsLoc, "w") as f:
+        json.dump(params, f)
+
+
+def time_stage(results, stage, func, *args):
+    print("⏱ Timing %s..." % stage)
+
+    wallStart = time.perf_counter()
+    cpuStart = time.process_time()
+
+    output = func(*args)
+
+    results[stage] = {
+        "wall": time.perf_counter() - wallStart,
+        "cpu": time.process_time() - cpuStart
+    }
+
+    return output
+
+
+def run_scale(scale, params):
+    make_export(scale, params)
+
+    with open('exampleconfig.json', 'r') as f:
+        config = json.load(f)
+
+    # Debug forces every stage to really run
+    config['debug'] = True
+    config['zipFile'] = "benchmark-" + scale
+    config['myName'] = myName
+
+    graphConfig = config['messagesOverTime']
+    processedLoc = "processed-data/" + config['zipFile'] + "/"
+    outputLoc = "output-data/" + config['zipFile'] + "/"
+    Path(outputLoc).mkdir(parents=True, exist_ok=True)
+
+    stages = {}
+    movt = MessagesOverTime()
+
+    if config.get('streamZip', False):
+        time_stage(stages, "unzip", ZipFuncs().run_stream_check, config)
+    else:
+        time_stage(stages, "unzip", ZipFuncs().run_unzip_process, config)
+    time_stage(stages, "process", ProcessorFuncs().run_processing, config)
+    # Shared like the scheduler does, so the cube is read once
+    dataset = ProcessedDataset(config)
+    dataset.require(TopContactDetails.tables)
+    dataset.require(MessagesOverTime.tables)
+
+    time_stage(stages, "topContacts",
+               TopContactDetails().generate_all_graphs, config, dataset)
+    df = time_stage(stages, "framePrep",
+                    movt.frame_data, dataset, graphConfig)
+    time_stage(stages, "render", movt.render, df, graphConfig,
+               outputLoc + "messagesovertime.mp4")
+
+    # Throughput in messages per second for each stage
+    messages = len(DataStoreFuncs().read_messages(
+        processedLoc, columns=['threadID']))
+    for stage in stages.values():
+        stage['messagesPerSec'] = messages / stage['wall']
+
+    return {
+        "params": params,
+        "messages": messages,
+        "frames": len(df['frame'].unique()),
+        "stages": stages
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    print("====================================")
+    print("Stage timings (wall seconds)")
+    print("====================================")
+
+    for scale, scaleResults in results['scales'].items():
+        baseStages = {}
+        if baseline is not None and scale in baseline['scales']:
+            baseStages = baseline['scales'][scale]['stages']
+
+        print("%s (%s messages)" % (scale, scaleResults['messages']))
+        for stage, timing in scaleResults['stages'].items():
+            line = "  %-12s %8.2fs" % (stage, timing['wall'])
+
+            if stage in baseStages:
+                change = timing['wall'] / baseStages[stage]['wall'] - 1
+                line += "  %+6.1f%% vs baseline" % (change * 100)
+                if change > slowerBy:
+                    line += "  ⚠ slower"
+
+            print(line)
+
+
+if __name__ == "__main__":
+
+    args = sys.argv[1:]
+    saveBaseline = "--save-baseline" in args
+    chosen = [arg for arg in args if arg in scales]
+    if len(chosen) == 0:
+        chosen = ["small", "medium"]
+
+    print("====================================")
+    print("⛏ Starting the Messenger Benchmarks")
+    print("====================================")
+
+    results = {
+        "startTime": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "scales": {}
+    }
+
+    for scale in chosen:
+        print("##############################")
+        print("# Benchmarking %s" % scale)
+        print("##############################")
+        results['scales'][scale] = run_scale(scale, scales[scale])
+
+    Path(resultsLoc).mkdir(parents=True, exist_ok=True)
+    resultsFile = resultsLoc + time.strftime("%Y%m%d-%H%M%S") + ".json"
+    with open(resultsFile, "w") as f:
+        json.dump(results, f, indent=4)
+
+    baseline = None
+    if os.path.exists(baselineLoc):
+        with open(baselineLoc, "r") as f:
+            baseline = json.load(f)
+
+    compare(results, baseline)
+
+    if saveBaseline:
+        with open(baselineLoc, "w") as f:
+            json.dump(results, f, indent=4)
+        print("Saved as the new baseline")
+
+    print("====================================")
+    print("✓ Benchmarks saved to %s" % resultsFile)
+    print("====================================")
@@ -17,6 +17,8 @@ from tqdm import tqdm
 import random
 import shutil
 
+from scripts.jsonparser import JsonFuncs
+
 if __name__ == "__main__":
 
     inboxLoc = "raw-data/facebook-example/messages/inbox/"
@@ -46,6 +48,9 @@ if __name__ == "__main__":
                     if root not in contactDirs:
                         contactDirs.append(root)
 
+    jsonFuncs = JsonFuncs()
+    parser = jsonFuncs.get_parser({})
+
     print("Filtering messages and creating dataframes...")
 
     existingMap = {}
@@ -53,8 +58,8 @@ if __name__ == "__main__":
     # We first want to scramble each message file
     for messageFile in messageFiles:
         print("Loading next file...")
-        with open(messageFile['path'], "r", encoding="utf-8") as f:
-            messages = json.load(f)
+        with open(messageFile['path'], "rb") as f:
+            messages = jsonFuncs.load(f, parser)
 
         contact1 = messages['participants'][1]['name']
         newcontact1 = myname
@@ -121,8 +126,8 @@ if __name__ == "__main__":
 
         fPath = contactDir + "/message_1.json"
 
-        with open(fPath, "r", encoding="utf-8") as f:
-            messages = json.load(f)
+        with open(fPath, "rb") as f:
+            messages = jsonFuncs.load(f, parser)
             title = messages['title']
             title = title.replace(" ", "")
 
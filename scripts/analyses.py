@@ -0,0 +1,22 @@
+###################################
+# analyses.py
+###################################
+"""
+Author: Matt Balshaw
+Start Date: 18/10/2026
+
+The registry of analyses run on the processed data
+Each analysis has a stage name and title, the tables and columns it reads,
+and a run method taking the config and the shared ProcessedDataset
+Adding an analysis here is all it takes to have it run
+"""
+
+from scripts.topcontactdetails import TopContactDetails
+from scripts.messagesovertime import MessagesOverTime
+
+
+# Run in this order when run one at a time
+analyses = [
+    TopContactDetails,
+    MessagesOverTime
+]
@@ -0,0 +1,69 @@
+###################################
+# dailycube.py
+###################################
+"""
+Author: Matt Balshaw
+Start Date: 18/10/2026
+
+Builds the daily message cube
+The cube holds one row per thread, local day and direction, with the
+message count, characters, longest message and conversation starts, so
+analyses can scan thousands of rows instead of every message
+"""
+
+import pandas as pd
+import numpy as np
+from dateutil import tz
+
+
+class DailyCubeFuncs():
+
+    keys = ['threadID', 'day_ms', 'received']
+
+    def build_cube(self, allMessagesDF):
+        # Aggregate messages into thread x day x direction cells
+        cubeDF = allMessagesDF.groupby(
+            self.keys, observed=True, sort=False).agg(
+            msgs=('len', 'size'),
+            chars=('len', 'sum'),
+            maxChars=('len', 'max'),
+            convStarts=('startedConv', 'sum')
+        ).reset_index()
+
+        return self.finish_cube(cubeDF)
+
+    def combine_cubes(self, cubes):
+        # Merges cubes built from consecutive chunks of the message table
+        # Cells keep the order they first appear in, like build_cube
+        cubeDF = pd.concat(cubes, ignore_index=True).groupby(
+            self.keys, observed=True, sort=False).agg(
+            msgs=('msgs', 'sum'),
+            chars=('chars', 'sum'),
+            maxChars=('maxChars', 'max'),
+            convStarts=('convStarts', 'sum')
+        ).reset_index()
+
+        return self.finish_cube(cubeDF)
+
+    def finish_cube(self, cubeDF):
+        cubeDF = cubeDF.astype({
+            "msgs": "int32",
+            "chars": "int64",
+            "maxChars": "int32",
+            "convStarts": "int32"
+        })
+
+        return cubeDF.sort_values(
+            by=['day_ms'], kind='stable').reset_index(drop=True)
+
+    def day_starts(self, timestamps):
+        # The start in ms of the local day each ms timestamp falls in,
+        # the same days the cube is grouped by
+        localZone = tz.gettz() or tz.tzlocal()
+        dayStarts = pd.to_datetime(
+            np.asarray(timestamps), unit='ms', utc=True
+        ).tz_convert(localZone).normalize().tz_convert('UTC')
+
+        return np.asarray(
+            (dayStarts - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(1, 'ms'),
+            dtype=np.int64)
@@ -0,0 +1,86 @@
+###################################
+# dataset.py
+###################################
+"""
+Author: Matt Balshaw
+Start Date: 18/10/2026
+
+Holds the processed tables of one export in memory for the analyses
+Each analysis declares the tables and columns it needs, and every column
+asked for by any analysis is read in one go the first time a table is
+used, so the processed data is read once however many analyses there are
+"""
+
+import pandas as pd
+import sys
+
+from scripts.datastore import DataStoreFuncs
+from scripts import instrument
+
+
+class ProcessedDataset():
+
+    def __init__(self, config):
+        self.processedLoc = "processed-data/" + config['zipFile'] + "/"
+        self.outputLoc = "output-data/" + config['zipFile'] + "/"
+        self.store = DataStoreFuncs()
+
+        # Columns wanted from each table, and the tables read so far
+        self.needed = {}
+        self.frames = {}
+        self.checked = False
+
+    def check(self):
+        # Only the first analysis needs to check the data is there
+        if self.checked:
+            return
+
+        doesExist, errorMessage = self.store.check_processed(
+            self.processedLoc)
+        if not doesExist:
+            print(errorMessage)
+            print("☠ Critical error, exiting...")
+            sys.exit()
+
+        self.checked = True
+
+    def require(self, tables):
+        # Adds the columns an analysis needs, as {table: [columns]}
+        for table, columns in tables.items():
+            needed = self.needed.setdefault(table, [])
+            needed.extend(c for c in columns if c not in needed)
+
+    def input_locs(self, tables):
+        # The stored files the tables are read from, for the stage cache
+        # Thread keyed tables also depend on the threads table
+        locs = []
+        for table in tables:
+            locs.append(self.store.find_table(self.processedLoc, table)[0])
+            if table in self.store.threadKeyed:
+                locs.append(
+                    self.store.find_table(self.processedLoc, "threads")[0])
+
+        return locs
+
+    def get(self, table, columns):
+        # Returns the columns of a table, reading any we don't have yet
+        self.require({table: columns})
+
+        tableDF = self.frames.get(table)
+        have = [] if tableDF is None else list(tableDF.columns)
+        missing = [c for c in self.needed[table] if c not in have]
+
+        if len(missing) > 0:
+            with instrument.step("load"):
+                print("Loading %s columns of %s" % (len(missing), table))
+                newDF = self.store.read_table(
+                    self.processedLoc, table, missing)
+                instrument.add_rows(len(newDF))
+
+            if tableDF is None:
+                tableDF = newDF
+            else:
+                tableDF = pd.concat([tableDF, newDF], axis=1)
+            self.frames[table] = tableDF
+
+        return tableDF[columns]
@@ -0,0 +1,267 @@
+###################################
+# datastore.py
+###################################
+"""
+Author: Matt Balshaw
+Start Date: 18/10/2026
+
+Reads and writes the processed message, contact and thread tables
+Stores them as columnar parquet so analyses can load only the columns
+they need, with csv kept as a fallback and optional export
+Messages and the daily cube only store an integer threadID, the thread's
+contactID, name and group flag are looked up from the threads table
+"""
+
+import pandas as pd
+import os
+from pathlib import Path
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+    hasParquet = True
+except ImportError:
+    hasParquet = False
+
+
+class DataStoreFuncs():
+
+    # Bump when the processed columns change, so old data is rebuilt
+    schemaVersion = 5
+
+    tables = {
+        "contacts": "contactData",
+        "threads": "threadData",
+        "participants": "participantData",
+        "senders": "senderData",
+        "messages": "allMessageData",
+        "cube": "dailyCube"
+    }
+
+    # Tables keyed by threadID, and the columns they get from threads
+    threadKeyed = ["messages", "cube"]
+    threadColumns = ["contactID", "name", "isGroup"]
+
+    # Strings repeated on every row are stored as categories
+    dtypes = {
+        "contactID": "category",
+        "name": "category",
+        "type": "category",
+        "timestamp_ms": "int64",
+        "day_ms": "int64",
+        "threadID": "int32",
+        "senderID": "int32",
+        "isGroup": "bool",
+        "received": "bool",
+        "startedConv": "bool"
+    }
+
+    def get_format(self, config):
+        # Work out which format we can actually write
+        fmt = config.get('processedFormat', 'parquet')
+
+        if fmt == 'parquet' and not hasParquet:
+            print("⚠ pyarrow not installed, storing processed data as csv")
+            fmt = 'csv'
+
+        return fmt
+
+    def table_loc(self, processedLoc, table, fmt):
+        return processedLoc + self.tables[table] + "." + fmt
+
+    def find_table(self, processedLoc, table):
+        # Prefer parquet, but fall back to an existing csv
+        for fmt in ['parquet', 'csv']:
+            if fmt == 'parquet' and not hasParquet:
+                continue
+            loc = self.table_loc(processedLoc, table, fmt)
+            if os.path.exists(loc):
+                return loc, fmt
+
+        return None, None
+
+    def check_processed(self, processedLoc):
+        # Ensure that the directory exists and is correct
+
+        for table in self.tables:
+            loc, fmt = self.find_table(processedLoc, table)
+            if loc is None:
+                return False, "No %s file found" % self.tables[table]
+
+        return True, "Found processed data"
+
+    def write_table(self, processedLoc, table, tableDF, config):
+        # Ensure path exists
+        Path(processedLoc).mkdir(parents=True, exist_ok=True)
+
+        fmt = self.get_format(config)
+
+        tableDF = self.apply_dtypes(tableDF)
+
+        if fmt == 'parquet':
+            tableDF.to_parquet(
+                self.table_loc(processedLoc, table, 'parquet'), index=False)
+
+            # Remove any stale csv so it is never read by mistake
+            csvLoc = self.table_loc(processedLoc, table, 'csv')
+            if config.get('exportCsv', False):
+                tableDF.to_csv(csvLoc)
+            elif os.path.exists(csvLoc):
+                os.remove(csvLoc)
+        else:
+            tableDF.to_csv(self.table_loc(processedLoc, table, 'csv'))
+
+            # Parquet is read first, so remove any stale copy of it
+            parquetLoc = self.table_loc(processedLoc, table, 'parquet')
+            if os.path.exists(parquetLoc):
+                os.remove(parquetLoc)
+
+    def read_table(self, processedLoc, table, columns=None):
+        loc, fmt = self.find_table(processedLoc, table)
+
+        if loc is None:
+            return None
+
+        # Thread columns aren't stored on thread keyed tables, so read the
+        # threadID instead and look them up
+        joined = []
+        readColumns = columns
+        if table in self.threadKeyed:
+            joined = self.threadColumns
+            if columns is not None:
+                joined = [c for c in columns if c in self.threadColumns]
+                readColumns = [c for c in columns if c not in joined]
+                if len(joined) > 0 and 'threadID' not in readColumns:
+                    readColumns.append('threadID')
+
+        if fmt == 'parquet':
+            tableDF = pd.read_parquet(loc, columns=readColumns)
+        else:
+            tableDF = pd.read_csv(loc, usecols=readColumns)
+            # The csv index is never needed
+            if 'Unnamed: 0' in tableDF.columns:
+                tableDF = tableDF.drop(columns=['Unnamed: 0'])
+
+        tableDF = self.apply_dtypes(tableDF)
+
+        if len(joined) > 0:
+            tableDF = self.join_threads(processedLoc, tableDF, joined)
+            if columns is not None:
+                tableDF = tableDF[columns]
+
+        return tableDF
+
+    def read_table_chunks(self, processedLoc, table, chunkRows, columns=None):
+        # Yields the stored table a few rows at a time, without looking up
+        # thread columns, so large tables can be read in bounded memory
+        loc, fmt = self.find_table(processedLoc, table)
+
+        if fmt == 'parquet':
+            parquetFile = pyarrow.parquet.ParquetFile(loc)
+            for batch in parquetFile.iter_batches(
+                    batch_size=chunkRows, columns=columns):
+                yield self.apply_dtypes(batch.to_pandas())
+        else:
+            for chunkDF in pd.read_csv(loc, chunksize=chunkRows):
+                if 'Unnamed: 0' in chunkDF.columns:
+                    chunkDF = chunkDF.drop(columns=['Unnamed: 0'])
+                if columns is not None:
+                    chunkDF = chunkDF[columns]
+                yield self.apply_dtypes(chunkDF)
+
+    def open_writer(self, processedLoc, table, config):
+        return TableWriter(self, processedLoc, table, config)
+
+    def join_threads(self, processedLoc, tableDF, columns):
+        # threadID is the row of each thread in the threads table, so the
+        # lookup is a take, and categories stay categories
+        threadDF = self.read_table(processedLoc, "threads", columns)
+        threadIDs = tableDF['threadID'].to_numpy()
+
+        for i, column in enumerate(columns):
+            tableDF.insert(i, column, threadDF[column].array.take(threadIDs))
+
+        return tableDF
+
+    def read_messages(self, processedLoc, columns=None):
+        return self.read_table(processedLoc, "messages", columns)
+
+    def read_contacts(self, processedLoc, columns=None):
+        return self.read_table(processedLoc, "contacts", columns)
+
+    def read_cube(self, processedLoc, columns=None):
+        return self.read_table(processedLoc, "cube", columns)
+
+    def apply_dtypes(self, tableDF):
+        for column, dtype in self.dtypes.items():
+            if column in tableDF.columns:
+                tableDF[column] = tableDF[column].astype(dtype)
+
+        return tableDF
+
+
+class TableWriter():
+    # Writes a table a chunk at a time, for tables too big to hold at once
+    # The table is written beside the old one and swapped in on close, so
+    # the old table can still be read while writing
+
+    def __init__(self, store, processedLoc, table, config):
+        Path(processedLoc).mkdir(parents=True, exist_ok=True)
+
+        self.store = store
+        self.fmt = store.get_format(config)
+        self.loc = store.table_loc(processedLoc, table, self.fmt)
+        self.csvLoc = store.table_loc(processedLoc, table, 'csv')
+        self.parquetLoc = store.table_loc(processedLoc, table, 'parquet')
+        self.exportCsv = self.fmt == 'csv' or config.get('exportCsv', False)
+        self.parquetWriter = None
+        self.rows = 0
+
+        # Any old copies are replaced on close
+        for loc in [self.loc, self.csvLoc]:
+            if os.path.exists(loc + ".partial"):
+                os.remove(loc + ".partial")
+
+    def write(self, chunkDF):
+        chunkDF = self.store.apply_dtypes(chunkDF)
+        chunkDF.index = pd.RangeIndex(self.rows, self.rows + len(chunkDF))
+
+        if self.fmt == 'parquet':
+            # Categories can differ between chunks, so store plain values
+            # and let apply_dtypes restore them on read
+            for column in chunkDF.columns:
+                if isinstance(chunkDF[column].dtype, pd.CategoricalDtype):
+                    chunkDF[column] = chunkDF[column].astype(
+                        chunkDF[column].cat.categories.dtype)
+
+            if self.parquetWriter is None:
+                table = pyarrow.Table.from_pandas(
+                    chunkDF, preserve_index=False)
+                self.parquetWriter = pyarrow.parquet.ParquetWriter(
+                    self.loc + ".partial", table.schema)
+            else:
+                table = pyarrow.Table.from_pandas(
+                    chunkDF, schema=self.parquetWriter.schema,
+                    preserve_index=False)
+            self.parquetWriter.write_table(table)
+
+        if self.exportCsv:
+            chunkDF.to_csv(
+                self.csvLoc + ".partial", mode='a', header=self.rows == 0)
+
+        self.rows += len(chunkDF)
+
+    def close(self):
+        if self.parquetWriter is not None:
+            self.parquetWriter.close()
+            os.replace(self.loc + ".partial", self.loc)
+
+        if self.exportCsv:
+            os.replace(self.csvLoc + ".partial", self.csvLoc)
+        elif os.path.exists(self.csvLoc):
+            # Remove any stale csv so it is never read by mistake
+            os.remove(self.csvLoc)
+
+        if self.fmt == 'csv' and os.path.exists(self.parquetLoc):
+            # Parquet is read first, so remove any stale copy of it
+            os.remove(self.parquetLoc)
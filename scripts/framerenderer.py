@@ -0,0 +1,279 @@
+###################################
+# framerenderer.py
+###################################
+"""
+Author: Matt Balshaw
+Start Date: 18/10/2026
+
+Draws the frames of the messages over time bar chart race
+The bars and labels are created once and only updated for each frame
+Frames can be drawn in worker processes, each with its own figure,
+and are piped back in order to a single video encoder
+"""
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import matplotlib.ticker as ticker
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+
+
+class BarChartRenderer():
+
+    def __init__(self, df, graphConfig):
+        self.df = df
+        self.graphConfig = graphConfig
+        self.maxShown = graphConfig['maxFriendsShown']
+
+        # Create the color index for use in the graph
+        self.colors = {}
+        for gName in graphConfig['friendGroups']:
+            self.colors[gName] = graphConfig['friendGroups'][gName]['color']
+        self.group_lk = df.set_index('name')['group'].to_dict()
+
+        # The frame data is ordered by frame, so each frame is a slice
+        frameNumbers = df['frame'].to_numpy()
+        self.minFrame = frameNumbers.min()
+        self.maxFrame = frameNumbers.max()
+        self.frameStarts = np.searchsorted(
+            frameNumbers, np.arange(self.minFrame, self.maxFrame + 2))
+
+        # Tweened frame data carries its own ranks, and contacts sliding
+        # in and out can mean more bars than maxFriendsShown at once
+        self.tweened = 'rank' in df.columns
+        self.slots = self.maxShown
+        if self.tweened:
+            visibleRows = df[df['rank'] < self.maxShown]
+            self.slots = int(visibleRows.groupby('frame').size().max())
+
+        # Each renderer draws on its own figure, so it is safe to use one
+        # per process
+        self.fig = Figure(
+            figsize=(graphConfig['width'], graphConfig['height']),
+            dpi=graphConfig.get('dpi'))
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot(1, 1, 1)
+        self.background = None
+
+        self.create_artists()
+
+    def create_artists(self):
+        # Every bar and label is created once, frames only update them
+        ax = self.ax
+
+        slots = range(self.slots)
+        self.bars = ax.barh(list(slots), [0] * self.slots).patches
+
+        self.nameTexts = []
+        self.valueTexts = []
+        for i in slots:
+            # Draw the name
+            self.nameTexts.append(ax.text(
+                0,
+                i,
+                "",
+                size=14,
+                weight=600,
+                ha='left',
+                va='center'
+            ))
+
+            # Draw the value and group
+            self.valueTexts.append(ax.text(
+                0,
+                i - .25,
+                "",
+                size=8,
+                ha='left',
+                va='baseline'
+            ))
+
+        # Draw the time
+        self.timeText = ax.text(
+            1,
+            0.4,
+            "",
+            transform=ax.transAxes,
+            color='#777777',
+            size=18,
+            ha='right',
+            weight=800
+        )
+        # Draw axes label
+        ax.text(
+            0,
+            1.04,
+            'Messages Exchanged in 12 month period',
+            transform=ax.transAxes,
+            size=12,
+            color='#777777'
+        )
+
+        # Set title of the graph
+        minTime = self.df.head(1)['timeMin'].item()
+        maxTime = self.df.tail(1)['timeMax'].item()
+
+        title = "Most Messaged People From %s to %s" % (
+            minTime, maxTime)
+
+        ax.text(
+            0,
+            1.08,
+            title,
+            transform=ax.transAxes,
+            size=16,
+            weight=600,
+            ha='left'
+        )
+
+        # Misc formatting
+        ax.xaxis.set_major_formatter(ticker.StrMethodFormatter('{x:,.0f}'))
+        ax.xaxis.set_ticks_position('top')
+        ax.tick_params(axis='x', colors='#777777', labelsize=12)
+        ax.set_yticks([])
+        ax.grid(which='major', axis='x', linestyle='-')
+        ax.set_axisbelow(True)
+        ax.set_frame_on(False)
+
+        # Lay the graph out once, using the frame with the widest axis
+        biggestFrame = self.df['frame'].iloc[self.df['value'].argmax()]
+        self.draw_frame(biggestFrame)
+        self.fig.tight_layout(h_pad=2)
+
+    def draw_frame(self, frame):
+        ax = self.ax
+
+        # If frame is over max, assume we want to render the last frame
+        if frame > self.maxFrame:
+            frame = self.maxFrame
+
+        # Get our slice of the graph
+        start = self.frameStarts[frame - self.minFrame]
+        end = self.frameStarts[frame - self.minFrame + 1]
+        dff = self.df.iloc[start:end]
+
+        if self.tweened:
+            dff = dff[dff['rank'] < self.maxShown].sort_values(
+                by='rank', ascending=False)
+            ranks = dff['rank'].tolist()
+            shown = dff['shown'].iloc[0]
+        else:
+            dff = dff.sort_values(
+                by='value', ascending=True).tail(self.maxShown)
+            shown = len(dff)
+            ranks = [shown - 1 - i for i in range(shown)]
+
+        values = dff['value'].tolist()
+        names = dff['name'].tolist()
+
+        # Update the bars and labels in place
+        # Rank 0 is the top bar, so it sits highest on the y axis
+        dx = max(values) / 200
+        for i in range(self.slots):
+            visible = i < len(values)
+            self.bars[i].set_visible(visible)
+            self.nameTexts[i].set_visible(visible)
+            self.valueTexts[i].set_visible(visible)
+            if not visible:
+                continue
+
+            value = values[i]
+            name = names[i]
+            group = self.group_lk[name]
+            y = shown - 1 - ranks[i]
+
+            self.bars[i].set_y(y - 0.4)
+            self.bars[i].set_width(value)
+            self.bars[i].set_facecolor(self.colors[group])
+
+            # Labels aren't clipped to the axes, so hide them while their
+            # bar slides in or out below the bottom
+            if y < -0.5:
+                self.nameTexts[i].set_visible(False)
+                self.valueTexts[i].set_visible(False)
+
+            self.nameTexts[i].set_position((dx, y))
+            self.nameTexts[i].set_text(name)
+
+            self.valueTexts[i].set_position((value + dx, y - .25))
+            self.valueTexts[i].set_text(
+                group + ", " + f'{value:,.0f}' + " Messages")
+
+        self.timeText.set_text(
+            dff['timeMin'].iloc[-1] + " to " + dff['timeMax'].iloc[-1])
+
+        # Match the limits barh would autoscale to for the shown bars
+        # Bars are 0.8 high and centred on their slot, with a 1% margin
+        yRange = shown - 0.2
+        ax.set_xlim(0, max(values))
+        ax.set_ylim(-0.4 - 0.01 * yRange, shown - 0.6 + 0.01 * yRange)
+
+    def frame_size(self):
+        width, height = self.canvas.get_width_height()
+        return width, height
+
+    def render_frame(self, frame):
+        # Draw the frame and return its raw RGBA pixels, as a view of the
+        # canvas buffer which is only valid until the next frame is drawn
+        # Static parts (title, axis label) are drawn once and blitted back
+        # in, so only the changing artists are redrawn each frame
+        # Once used, the changing artists are animated, so the figure
+        # should no longer be drawn with savefig
+        if self.background is None:
+            self.animatedArtists = [self.ax.xaxis] + self.bars + \
+                self.nameTexts + self.valueTexts + [self.timeText]
+            for artist in self.animatedArtists:
+                artist.set_animated(True)
+            self.canvas.draw()
+            self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+
+        self.draw_frame(frame)
+
+        self.canvas.restore_region(self.background)
+        for artist in self.animatedArtists:
+            self.ax.draw_artist(artist)
+
+        return self.canvas.buffer_rgba().cast('B')
+
+
+# Each worker process builds one renderer from the frame data
+workerRenderer = None
+
+
+def init_worker(df, graphConfig):
+    global workerRenderer
+    workerRenderer = BarChartRenderer(df, graphConfig)
+
+
+def render_chunk(frames):
+    # Frames are copied out of the canvas to be sent back
+    return [bytes(workerRenderer.render_frame(frame)) for frame in frames]
+
+
+def render_parallel(df, graphConfig, frames, writer, workers, pbar=None):
+    # Split the frames into small chunks and hand them out to workers
+    # Results are written in order, with only a few chunks in flight so
+    # finished frames don't pile up in memory
+    chunkSize = 8
+    chunks = [frames[i:i + chunkSize]
+              for i in range(0, len(frames), chunkSize)]
+
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=init_worker,
+                             initargs=(df, graphConfig)) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(render_chunk, chunk))
+            if len(pending) >= workers * 2:
+                write_chunk(pending.popleft().result(), writer, pbar)
+
+        while pending:
+            write_chunk(pending.popleft().result(), writer, pbar)
+
+
+def write_chunk(renderedFrames, writer, pbar):
+    for frameBytes in renderedFrames:
+        writer.write(frameBytes)
+        if pbar is not None:
+            pbar.update(1)
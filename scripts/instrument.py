@@ -0,0 +1,245 @@
+###################################
+# instrument.py
+###################################
+"""
+Author: Matt Balshaw
+Start Date: 18/10/2026
+
+Records how long each stage of the analysis takes and what it costs
+Every step notes its wall and cpu time, peak memory, rows per second and
+bytes read and written, and the whole run is saved as a json report
+Work done a file at a time, or inside worker processes, is added up with
+add_time and shows under the step it happened in
+"""
+
+import cProfile
+import time
+import json
+import sys
+import os
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+# Not available on windows, where peak memory isn't reported
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# The InstrumentFuncs for the current run, if there is one
+recorder = None
+
+# Time added up since the innermost step started, by name
+# Workers keep their own and send them back with their results
+enabled = False
+timings = {}
+
+
+def start_run(config):
+    global recorder, enabled
+    recorder = InstrumentFuncs(config)
+    enabled = True
+    return recorder
+
+
+def step(name):
+    # Times a block as a step of whichever step is currently open
+    if recorder is None:
+        return nullcontext()
+    return recorder.step(name)
+
+
+def add_rows(rows):
+    # Rows handled by the innermost step, for its rows per second
+    if recorder is not None and len(recorder.stack) > 0:
+        recorder.stack[-1]['rows'] += rows
+
+
+def add_time(name, seconds, rows=0, size=0):
+    # Adds to the time spent on name, along with the rows and bytes done
+    if not enabled:
+        return
+    timing = timings.setdefault(name, new_timing())
+    timing['wallSecs'] += seconds
+    timing['calls'] += 1
+    timing['rows'] += rows
+    timing['bytes'] += size
+
+
+def new_timing():
+    return {"wallSecs": 0.0, "calls": 0, "rows": 0, "bytes": 0}
+
+
+def take_timings():
+    # Hands over the timings added up so far and starts again
+    global timings
+    taken = timings
+    timings = {}
+    return taken
+
+
+def merge_timings(taken):
+    # Adds timings sent back from a worker process to our own
+    for name, timing in taken.items():
+        mine = timings.setdefault(name, new_timing())
+        for key in mine:
+            mine[key] += timing[key]
+
+
+class InstrumentFuncs():
+
+    def __init__(self, config):
+        outputLoc = "output-data/" + config['zipFile'] + "/"
+        self.reportLoc = outputLoc + "runreport.json"
+        self.profileLoc = outputLoc + "profiles/"
+        self.profile = config.get('profileStages', False)
+
+        self.report = {
+            "zipFile": config['zipFile'],
+            "startTime": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "cpus": os.cpu_count(),
+            "stages": []
+        }
+        self.stack = []
+        self.runStart = time.perf_counter()
+
+    @contextmanager
+    def step(self, name):
+        # Anything added up by an outer step so far belongs to it
+        if len(self.stack) > 0:
+            self.add_timings(self.stack[-1])
+
+        # The peak memory counter is reset for each step, so keep the
+        # peak seen so far for every step that is still open
+        for record in self.stack:
+            record['peak'] = max(record['peak'], self.peak_rss())
+        reset = self.reset_peak()
+
+        record = {
+            "name": name,
+            "rows": 0,
+            "peak": 0,
+            "steps": []
+        }
+        start = self.sample()
+        self.stack.append(record)
+
+        profiler = None
+        if self.profile and len(self.stack) == 1:
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        try:
+            yield record
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                Path(self.profileLoc).mkdir(parents=True, exist_ok=True)
+                profiler.dump_stats(self.profileLoc + name + ".prof")
+
+            end = self.sample()
+            self.stack.pop()
+            self.add_timings(record)
+            self.finish_record(record, start, end, reset)
+
+            if len(self.stack) > 0:
+                self.stack[-1]['steps'].append(record)
+            else:
+                self.report['stages'].append(record)
+
+    def add_timings(self, record):
+        for name, timing in take_timings().items():
+            added = dict(timing)
+            if timing['rows'] > 0 and timing['wallSecs'] > 0:
+                added['rowsPerSec'] = timing['rows'] / timing['wallSecs']
+            record['steps'].append(dict({"name": name}, **added))
+
+    def finish_record(self, record, start, end, reset):
+        wallSecs = end['wall'] - start['wall']
+        rows = record.pop('rows')
+        peak = max(record.pop('peak'), self.peak_rss())
+        steps = record.pop('steps')
+
+        record.update({
+            "wallSecs": wallSecs,
+            "cpuSecs": end['cpu'] - start['cpu'],
+            "workerCpuSecs": end['childCpu'] - start['childCpu'],
+            "peakRssMB": peak / 1024,
+            # Without a reset this is the peak of the whole run so far
+            "peakIsStepOnly": reset,
+            "rows": rows,
+            "rowsPerSec": rows / wallSecs if rows > 0 else None,
+            "bytesRead": self.delta(start, end, 'bytesRead'),
+            "bytesWritten": self.delta(start, end, 'bytesWritten')
+        })
+        if len(steps) > 0:
+            record['steps'] = steps
+
+    def delta(self, start, end, key):
+        if start[key] is None or end[key] is None:
+            return None
+        return end[key] - start[key]
+
+    def sample(self):
+        # Worker cpu is only counted once the workers have exited
+        times = os.times()
+        bytesRead, bytesWritten = self.read_io()
+
+        return {
+            "wall": time.perf_counter(),
+            "cpu": times.user + times.system,
+            "childCpu": times.children_user + times.children_system,
+            "bytesRead": bytesRead,
+            "bytesWritten": bytesWritten
+        }
+
+    def read_io(self):
+        # Bytes passed through read and write calls, only on linux
+        try:
+            with open("/proc/self/io", "r") as f:
+                fields = dict(line.split(": ") for line in f)
+            return int(fields['rchar']), int(fields['wchar'])
+        except (OSError, KeyError, ValueError):
+            return None, None
+
+    def peak_rss(self):
+        # Peak resident memory in KB since the last reset
+        try:
+            with open("/proc/self/status", "r") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+        return self.max_rss()
+
+    def max_rss(self):
+        # Peak resident memory in KB of the whole run
+        if resource is None:
+            return 0
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS reports bytes rather than KB
+        if sys.platform == "darwin":
+            return maxrss // 1024
+        return maxrss
+
+    def reset_peak(self):
+        # Linux lets us reset the peak so each step gets its own
+        try:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+            return True
+        except OSError:
+            return False
+
+    def save_report(self):
+        self.report['wallSecs'] = time.perf_counter() - self.runStart
+        self.report['peakRssMB'] = self.max_rss() / 1024
+
+        Path(os.path.dirname(self.reportLoc)).mkdir(
+            parents=True, exist_ok=True)
+        with open(self.reportLoc, "w", encoding="utf-8") as f:
+            json.dump(self.report, f, indent=4)
+
+        return self.reportLoc
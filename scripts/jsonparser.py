@@ -0,0 +1,92 @@
+###################################
+# jsonparser.py
+###################################
+"""
+Author: Matt Balshaw
+Start Date: 18/10/2026
+
+Loads the facebook message jsons with the fastest parser available
+orjson is used when installed, with the standard json module as fallback
+ijson can stream huge files, only keeping the fields we actually use
+"""
+
+import json
+import gc
+
+try:
+    import orjson
+    hasOrjson = True
+except ImportError:
+    hasOrjson = False
+
+try:
+    import ijson
+    hasIjson = True
+except ImportError:
+    hasIjson = False
+
+
+class JsonFuncs():
+
+    # The only parts of each message the processor reads
+    messageFields = ['sender_name', 'timestamp_ms', 'content', 'type']
+
+    def get_parser(self, config):
+        # Work out which parser we can actually use
+        parser = config.get('jsonParser', 'auto')
+
+        if parser == 'auto':
+            parser = 'orjson' if hasOrjson else 'json'
+
+        if parser == 'orjson' and not hasOrjson:
+            print("⚠ orjson not installed, using the json module")
+            parser = 'json'
+
+        if parser == 'ijson' and not hasIjson:
+            print("⚠ ijson not installed, using the json module")
+            parser = 'json'
+
+        return parser
+
+    def load(self, f, parser):
+        # f should be opened in binary mode
+        # Parsing creates millions of small dicts which can't form cycles,
+        # so the garbage collector is paused rather than scanning them
+        gcEnabled = gc.isenabled()
+        gc.disable()
+
+        try:
+            if parser == 'orjson':
+                return orjson.loads(f.read())
+
+            if parser == 'ijson':
+                return self.load_streaming(f)
+
+            return json.load(f)
+        finally:
+            if gcEnabled:
+                gc.enable()
+
+    def load_streaming(self, f):
+        # Builds the thread one event at a time, so nothing but the
+        # participants, title and our message fields are ever held
+        thread = {"participants": [], "messages": []}
+        message = None
+
+        for prefix, event, value in ijson.parse(f):
+            if prefix == 'messages.item':
+                if event == 'start_map':
+                    message = {}
+                elif event == 'end_map':
+                    thread['messages'].append(message)
+                    message = None
+            elif message is not None:
+                if prefix[14:] in self.messageFields and \
+                        prefix[:14] == 'messages.item.':
+                    message[prefix[14:]] = value
+            elif prefix == 'participants.item.name':
+                thread['participants'].append({"name": value})
+            elif prefix in ('title', 'thread_type') and event == 'string':
+                thread[prefix] = value
+
+        return thread
@@ -10,286 +10,440 @@ Also creates an animated video of the messages over time
 """
 
 import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib.ticker as ticker
-import matplotlib.animation as animation
 from IPython.display import HTML
 import datetime
-import os
+import time
 from pathlib import Path
-import sys
 import numpy as np
+import matplotlib.image
+import math
+import os
 from tqdm import tqdm
 
+from scripts.dataset import ProcessedDataset
+from scripts.dailycube import DailyCubeFuncs
+from scripts.stagecache import StageCacheFuncs
+from scripts.framerenderer import BarChartRenderer, render_parallel
+from scripts.videowriter import FFmpegWriter, GifWriter
+from scripts import instrument
+
 
 class MessagesOverTime():
 
-    def make_graphs(self, config, graphConfig):
+    # Preview gifs step through the sampled frames at this rate
+    previewFps = 4
+
+    # Settings only used by the preview or only by the video, which are
+    # left out of the other's cache key so they don't rerun each other
+    previewKeys = ['preview', 'previewFormat', 'previewFrames', 'previewDpi']
+    videoKeys = ['videoCodec', 'videoCrf', 'videoPreset', 'fastEncode']
+
+    # Settings which only change how fast the output is made
+    speedKeys = ['renderWorkers']
+
+    # Daily message counts per contact are all that is needed here
+    stage = "messagesOverTime"
+    title = "Messages Over Time"
+    tables = {
+        "cube": ['name', 'isGroup', 'day_ms', 'msgs']
+    }
 
-        processedLoc = "processed-data/" + config['zipFile'] + "/"
-        outpotLoc = "output-data/" + config['zipFile'] + "/"
+    def run(self, config, dataset):
+        self.make_graphs(config, config['messagesOverTime'], dataset)
+
+    def make_graphs(self, config, graphConfig, dataset=None):
+
+        if dataset is None:
+            dataset = ProcessedDataset(config)
+
+        dataset.check()
+
+        outpotLoc = dataset.outputLoc
 
         Path(outpotLoc).mkdir(parents=True, exist_ok=True)
 
-        allMsgLoc = processedLoc + "allMessageData.csv"
         outputVideo = outpotLoc + "messagesovertime.mp4"
         outputGraph = outpotLoc + "top15contactsbymessages.png"
 
-        if not os.path.exists(allMsgLoc):
-            print("Can't find the allMessageData.csv")
-            print("☠ Critical error, exiting...")
-            sys.exit()
-
-        if os.path.exists(outputVideo) and not config['debug']:
-            print("♻ Found existing messagesovertime.mp4")
+        # A preview is a few low resolution frames instead of the video
+        preview = graphConfig.get('preview', False)
+        if graphConfig.get('previewFormat', 'sheet') == 'gif':
+            outputPreview = outpotLoc + "messagesovertime-preview.gif"
+        else:
+            outputPreview = outpotLoc + "messagesovertime-preview.png"
+        output = outputPreview if preview else outputVideo
+
+        # The preview and the video are cached separately, so switching
+        # between them doesn't throw the other away
+        # Rerun when the daily cube or the settings they use have changed
+        cache = StageCacheFuncs(config)
+        if preview:
+            cacheStage = 'messagesOverTimePreview'
+            stageConfig = self.stage_config(
+                graphConfig, self.videoKeys + self.speedKeys + ['preview'])
+        else:
+            cacheStage = 'messagesOverTime'
+            stageConfig = self.stage_config(
+                graphConfig, self.previewKeys + self.speedKeys)
+        stageKey = cache.stage_key(
+            dataset.input_locs(self.tables), stageConfig)
+
+        if cache.is_fresh(cacheStage, stageKey, [output]) \
+                and not config['debug']:
+            print("♻ Found existing %s" % os.path.basename(output))
             return True
 
         print("Generating a messages over time graph")
 
-        AllMsgs = pd.read_csv(allMsgLoc, usecols=[
-                              'name', 'timestamp_ms'])
+        with instrument.step("framePrep"):
+            df = self.frame_data(dataset, graphConfig)
 
-        AllMsgs['msg'] = 1
+        if preview:
+            with instrument.step("preview"):
+                self.render_preview(df, graphConfig, outputPreview)
 
-        minTime = AllMsgs['timestamp_ms'].min()
-        maxTime = AllMsgs['timestamp_ms'].max()
+            cache.record(cacheStage, stageKey)
+            print("✓ Messages over time preview saved to %s" % outputPreview)
+            return
 
-        totalTime = maxTime - minTime
+        with instrument.step("render"):
+            self.render(df, graphConfig, outputVideo)
 
-        ###################
-        # Assign colors to groups
-        ###################
+        cache.record(cacheStage, stageKey)
+        print("✓ Messages over time animation complete")
 
-        metaGroupList = []
-        metaColorList = []
-        defaultGroupName = ""
-        for gName in graphConfig['friendGroups']:
-            metaGroupList.append(gName)
-            metaColorList.append(graphConfig['friendGroups'][gName]['color'])
-            if "default" in graphConfig['friendGroups'][gName] and graphConfig['friendGroups'][gName]['default']:
-                defaultGroupName = gName
+    def stage_config(self, graphConfig, ignored):
+        # The graph config without the settings that don't apply
+        return {key: value for key, value in graphConfig.items()
+                if key not in ignored}
 
-        fps = graphConfig['fps']
-        videoLen = graphConfig['videoLenSecs']
+    def frame_data(self, dataset, graphConfig):
+        # Works out the bars shown in every frame of the video
+        # Windows are counted in whole days, which is finer than the
+        # months shown on the graph
+        AllMsgs = dataset.get("cube", self.tables['cube'])
+        AllMsgs = AllMsgs.rename(columns={'day_ms': 'timestamp_ms'})
 
-        # 60s video with 5 fps, means we need 5 * 60 frames
+        # Group chats are left out unless asked for
+        if not graphConfig.get('includeGroupChats', False):
+            AllMsgs = AllMsgs[~AllMsgs['isGroup']]
 
-        frameTime = int(totalTime / (fps * videoLen))
+        print("Calculating data for graph...")
 
-        maxTime -= (12 * 2592000000)
+        tweenFrames = graphConfig.get('tweenFrames', 0)
 
-        frame = 0
+        if tweenFrames > 0:
+            # Only compute real data for every (tweenFrames + 1)th frame
+            keyConfig = dict(graphConfig)
+            keyConfig['fps'] = graphConfig['fps'] / (tweenFrames + 1)
 
-        df = pd.DataFrame()
+            keyDF = self.compute_frame_data(AllMsgs, keyConfig)
 
-        print("Calculating data for graph...")
+            print("Tweening %s frames between each keyframe" % tweenFrames)
+            df = self.tween_frame_data(keyDF, graphConfig, tweenFrames)
+        else:
+            df = self.compute_frame_data(AllMsgs, graphConfig)
 
-        for startTime in tqdm(range(minTime, maxTime, frameTime)):
-
-            endperiod = startTime + frameTime
-            maxTime = endperiod + (12 * 2592000000)
-
-            # add one year to end period to stabalize video
-            sect = AllMsgs[(AllMsgs['timestamp_ms'] < maxTime) & (
-                AllMsgs['timestamp_ms'] > (startTime))].copy()
-
-            # Concatinate sect
-            sect['totalMsgs'] = sect.groupby(
-                ['name'])['msg'].transform('sum')
-
-            sect = sect.drop_duplicates(subset=['name'])
-
-            # Ignore empty friends for speedup
-            # sect = sect[sect['totalMsgs'] > 2]
-
-            if len(sect) < 2:
-                continue
-            frame += 1
-
-            frameList = []
-            groupList = []
-            nameList = []
-            valueList = []
-            timeMinList = []
-            timeMaxList = []
-
-            for index, row in sect.iterrows():
-                if row['name'] == "Unknown":
-                    continue
-
-                # Need to go through each group name
-                # Check if our name in that group...
-                theName = row['name']
-                found = False
-                for group in metaGroupList:
-                    if theName in graphConfig['friendGroups'][group]['matchList']:
-                        groupList.append(group)
-                        found = True
-                        continue
-                if not found:
-                    groupList.append(defaultGroupName)
-
-                frameList.append(int(frame))
-                nameList.append(row['name'])
-                valueList.append(int(row['totalMsgs']))
-                dateMin = datetime.datetime.fromtimestamp(
-                    (startTime / 1000))
-                dateMax = datetime.datetime.fromtimestamp(
-                    (maxTime / 1000))
-                strMinTime = dateMin.strftime("%b %Y")
-                strMaxTime = dateMax.strftime("%b %Y")
-
-                timeMinList.append(strMinTime)
-                timeMaxList.append(strMaxTime)
-
-            newRows = {
-                "frame": frameList,
-                "name": nameList,
-                "group": groupList,
-                "value": valueList,
-                "timeMin": timeMinList,
-                "timeMax": timeMaxList,
-            }
-
-            newRowsDF = pd.DataFrame.from_dict(newRows)
-
-            df = df.append(newRowsDF)
-
-        # Fix floats to ints
-        df['frame'] = df['frame'].apply(np.int64)
-        df['value'] = df['value'].apply(np.int64)
-
-        # Create the color index for use in the graph
-        colors = dict(zip(
-            metaGroupList,
-            metaColorList
-        ))
-        group_lk = df.set_index('name')['group'].to_dict()
-
-        def draw_barchart(frame):
-
-            # If frame is over max, assume we want to render the last frame
-            if frame > df['frame'].max():
-                frame = df['frame'].max()
-
-            # Get our slice of the graph
-            dff = df[df['frame'].eq(frame)].sort_values(
-                by='value', ascending=True).tail(graphConfig['maxFriendsShown'])
-            # Clear prev graph
-            ax.clear()
-            # Create bar graph
-            ax.barh(
-                dff['name'],
-                dff['value'],
-                color=[colors[group_lk[x]]for x in dff['name']]
-            )
-
-            # Plot text on each bar
-            dx = dff['value'].max() / 200
-            for i, (value, name) in enumerate(zip(dff['value'], dff['name'])):
-                # Draw the name
-                ax.text(
-                    dx,
-                    i,
-                    name,
-                    size=14,
-                    weight=600,
-                    ha='left',
-                    va='center'
-                )
-
-                # Draw the value and group
-                ax.text(
-                    value + dx,
-                    i - .25,
-                    group_lk[name] + ", " + f'{value:,.0f}' + " Messages",
-                    size=8,
-                    ha='left',
-                    va='baseline'
-                )
-
-            # Draw the time
-            timeDisp = dff['timeMin'].tail(
-                1).item() + " to " + dff['timeMax'].tail(1).item()
-
-            ax.text(
-                1,
-                0.4,
-                timeDisp,
-                transform=ax.transAxes,
-                color='#777777',
-                size=18,
-                ha='right',
-                weight=800
-            )
-            # Draw axes label
-            ax.text(
-                0,
-                1.04,
-                'Messages Exchanged in 12 month period',
-                transform=ax.transAxes,
-                size=12,
-                color='#777777'
-            )
-
-            # Misc formatting
-            ax.xaxis.set_major_formatter(ticker.StrMethodFormatter('{x:,.0f}'))
-            ax.xaxis.set_ticks_position('top')
-            ax.tick_params(axis='x', colors='#777777', labelsize=12)
-            ax.set_yticks([])
-            ax.margins(0, 0.01)
-            ax.grid(which='major', axis='x', linestyle='-')
-            ax.set_axisbelow(True)
-
-            # Set title of the graph
-            minTime = df.head(1)['timeMin'].item()
-            maxTime = df.tail(1)['timeMax'].item()
-
-            title = "Most Messaged People From %s to %s" % (
-                minTime, maxTime)
-
-            ax.text(
-                0,
-                1.08,
-                title,
-                transform=ax.transAxes,
-                size=16,
-                weight=600,
-                ha='left'
-            )
-
-            # Ensure the graph has adequate spacing
-            plt.box(False)
-            plt.tight_layout(h_pad=2)
-            # Update the progress bar
-            pbar.update(1)
+        return df
 
+    def render(self, df, graphConfig, outputVideo):
         print("Generating animated graph...")
 
-        # Initialise our new graph
-        width = graphConfig['width']
-        height = graphConfig['height']
-
-        fig, ax = plt.subplots(figsize=(width, height))
+        fps = graphConfig['fps']
 
-        # Calculate intervals per sec for the animator
-        # Matplotlib uses ms per frame
-        interval = 1000 / fps
         # Calculate extra frames needed for a 5s end of video
         timeAtEnd = 5
         extraframes = fps * timeAtEnd
 
-        # Calculate total frames to display
-        numFrames = (df['frame'].max() + extraframes) - df['frame'].min()
+        frames = list(range(df['frame'].min(), df['frame'].max() + extraframes))
+        instrument.add_rows(len(frames))
+
+        workers = graphConfig.get('renderWorkers', 1)
+
+        if workers > 1:
+            self.render_video_parallel(
+                df, graphConfig, frames, outputVideo, workers)
+        else:
+            self.render_video(df, graphConfig, frames, outputVideo)
+
+    def render_video(self, df, graphConfig, frames, outputVideo):
+        # Each frame's canvas buffer is written straight to ffmpeg
+        renderer = BarChartRenderer(df, graphConfig)
+        width, height = renderer.frame_size()
+        writer = self.open_writer(outputVideo, width, height, graphConfig)
+
+        with tqdm(total=len(frames)) as pbar:
+            for frame in frames:
+                drawStart = time.perf_counter()
+                frameBuffer = renderer.render_frame(frame)
+                instrument.add_time(
+                    "drawFrame", time.perf_counter() - drawStart, rows=1)
+
+                writer.write(frameBuffer)
+                # Update the progress bar
+                pbar.update(1)
+
+        writer.close()
+
+    def render_video_parallel(self, df, graphConfig, frames, outputVideo,
+                              workers):
+        # Each worker renders raw frames with its own figure, which are
+        # piped in order to one ffmpeg encoder
+        print("Rendering with %s worker processes" % workers)
+
+        width, height = BarChartRenderer(df, graphConfig).frame_size()
+        writer = self.open_writer(outputVideo, width, height, graphConfig)
+
+        with tqdm(total=len(frames)) as pbar:
+            render_parallel(df, graphConfig, frames, writer, workers, pbar)
+
+        writer.close()
+
+    def render_preview(self, df, graphConfig, outputPreview):
+        # Draws a few evenly spaced frames at a low dpi, as a contact
+        # sheet or a short gif
+        previewConfig = dict(graphConfig)
+        previewConfig['dpi'] = graphConfig.get('previewDpi', 40)
+
+        renderer = BarChartRenderer(df, previewConfig)
+        width, height = renderer.frame_size()
+
+        frames = np.unique(np.linspace(
+            df['frame'].min(), df['frame'].max(),
+            graphConfig.get('previewFrames', 16)).round().astype(int))
+
+        print("Drawing %s preview frames" % len(frames))
+        instrument.add_rows(len(frames))
+
+        if outputPreview[-4:] == ".gif":
+            writer = GifWriter(outputPreview, width, height, self.previewFps)
+            for frame in frames:
+                writer.write(renderer.render_frame(frame))
+            writer.close()
+            return
+
+        # Lay the frames out in a grid, as near square as we can
+        columns = math.ceil(math.sqrt(len(frames)))
+        rows = math.ceil(len(frames) / columns)
+        sheet = np.full((rows * height, columns * width, 4), 255, np.uint8)
+
+        for i, frame in enumerate(frames):
+            image = np.frombuffer(renderer.render_frame(frame), np.uint8)
+            row, column = divmod(i, columns)
+            sheet[row * height:(row + 1) * height,
+                  column * width:(column + 1) * width] = \
+                image.reshape(height, width, 4)
+
+        matplotlib.image.imsave(outputPreview, sheet)
+
+    def open_writer(self, outputVideo, width, height, graphConfig):
+        # fastEncode trades a bigger file for a much quicker encode
+        preset = graphConfig.get('videoPreset')
+        if graphConfig.get('fastEncode', False):
+            preset = FFmpegWriter.fastPreset
+
+        return FFmpegWriter(
+            outputVideo, width, height, graphConfig['fps'],
+            codec=graphConfig.get('videoCodec'),
+            crf=graphConfig.get('videoCrf'),
+            preset=preset)
+
+    def compute_frame_data(self, AllMsgs, graphConfig):
+        # Counts the messages per contact in the 12 month window of every
+        # frame, for all frames at once
+        # Each window is (startTime, startTime + frameTime + 12 months)
+        # exclusive at both ends
+        yearTime = 12 * 2592000000
+
+        timestamps = AllMsgs['timestamp_ms'].to_numpy(dtype=np.int64)
+        codes, names = pd.factorize(AllMsgs['name'])
+
+        minTime = int(timestamps.min())
+        maxTime = int(timestamps.max())
 
-        with tqdm(total=numFrames) as pbar:
-            animator = animation.FuncAnimation(
-                fig,
-                draw_barchart,
-                interval=interval,
-                frames=tqdm(range(df['frame'].min(), df[
-                    'frame'].max() + extraframes))
-            )
-            animator.save(outputVideo)
+        totalTime = maxTime - minTime
 
-        print("✓ Messages over time animation complete")
+        fps = graphConfig['fps']
+        videoLen = graphConfig['videoLenSecs']
+
+        # 60s video with 5 fps, means we need 5 * 60 frames
+
+        frameTime = int(totalTime / (fps * videoLen))
+
+        startTimes = np.arange(minTime, maxTime - yearTime, frameTime,
+                               dtype=np.int64)
+        endTimes = startTimes + frameTime + yearTime
+
+        # Rows of the daily cube are whole local days, so each window edge
+        # is rounded to the nearest local midnight and every window counts
+        # whole days, rather than cutting days at its edges
+        dailyRows = 'msgs' in AllMsgs.columns
+        if dailyRows:
+            halfDay = 43200000
+            cube = DailyCubeFuncs()
+            lowEdges = cube.day_starts(startTimes + halfDay)
+            highEdges = cube.day_starts(endTimes + halfDay)
+        else:
+            lowEdges = startTimes
+            highEdges = endTimes
+
+        # Sort by contact then time, offsetting each contact into its own
+        # range so one searchsorted finds every window edge of every contact
+        span = (highEdges.max() if len(highEdges) else maxTime) - minTime + 1
+        keys = codes.astype(np.int64) * span + (timestamps - minTime)
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+
+        # Rows can stand for several messages (one day of the daily cube)
+        # so counts come from a running total of the message weights
+        if dailyRows:
+            weights = AllMsgs['msgs'].to_numpy(dtype=np.int64)[order]
+        else:
+            weights = np.ones(len(keys), dtype=np.int64)
+        runningMsgs = np.concatenate([[0], np.cumsum(weights)])
+
+        # Queries are built contact-major so they are already sorted, which
+        # keeps searchsorted cache friendly, then flipped to frame-major
+        contactOffsets = np.arange(len(names), dtype=np.int64) * span
+        lowKeys = contactOffsets[:, None] + (lowEdges - minTime)[None, :]
+        highKeys = contactOffsets[:, None] + (highEdges - minTime)[None, :]
+
+        # Messages strictly inside the window, or days from its first day
+        firstIdx = np.ascontiguousarray(np.searchsorted(
+            keys, lowKeys, side='left' if dailyRows else 'right').T)
+        lastIdx = np.ascontiguousarray(
+            np.searchsorted(keys, highKeys, side='left').T)
+        counts = runningMsgs[lastIdx] - runningMsgs[firstIdx]
+
+        # Frames need at least two people messaged in the window
+        keptFrames = (counts > 0).sum(axis=1) >= 2
+        frameNumbers = np.cumsum(keptFrames)
+
+        counts[~keptFrames] = 0
+        frameIdx, contactIdx = np.nonzero(counts)
+
+        # Order contacts in each frame by their first message in the window
+        firstTimes = keys[firstIdx[frameIdx, contactIdx]] - \
+            contactOffsets[contactIdx]
+        order = np.lexsort((firstTimes, frameIdx))
+        frameIdx = frameIdx[order]
+        contactIdx = contactIdx[order]
+
+        ###################
+        # Assign each contact to its group
+        ###################
+
+        defaultGroupName = ""
+        for gName in graphConfig['friendGroups']:
+            if "default" in graphConfig['friendGroups'][gName] and graphConfig['friendGroups'][gName]['default']:
+                defaultGroupName = gName
+
+        groups = []
+        for theName in names:
+            group = defaultGroupName
+            for gName in graphConfig['friendGroups']:
+                if theName in graphConfig['friendGroups'][gName]['matchList']:
+                    group = gName
+                    break
+            groups.append(group)
+
+        # Dates only need formatting once per frame
+        timeMins = [
+            datetime.datetime.fromtimestamp(t / 1000).strftime("%b %Y")
+            for t in startTimes
+        ]
+        timeMaxs = [
+            datetime.datetime.fromtimestamp(t / 1000).strftime("%b %Y")
+            for t in endTimes
+        ]
+
+        # Text columns are built as categoricals straight from the codes
+        # so no per-row strings are created
+        df = pd.DataFrame({
+            "frame": frameNumbers[frameIdx].astype(np.int64),
+            "name": self.to_categorical(contactIdx, names),
+            "group": self.to_categorical(contactIdx, groups),
+            "value": counts[frameIdx, contactIdx].astype(np.int64),
+            "timeMin": self.to_categorical(frameIdx, timeMins),
+            "timeMax": self.to_categorical(frameIdx, timeMaxs)
+        })
+
+        df = df[df['name'] != "Unknown"].reset_index(drop=True)
+
+        return df
+
+    def tween_frame_data(self, keyDF, graphConfig, tweenFrames):
+        # Interpolates values and ranks between keyframes, for every
+        # contact at once, so bars grow and slide smoothly between them
+        maxShown = graphConfig['maxFriendsShown']
+
+        keyframes = np.sort(keyDF['frame'].unique())
+        nameCodes, names = pd.factorize(keyDF['name'])
+        keyIdx = np.searchsorted(keyframes, keyDF['frame'].to_numpy())
+
+        # Keyframe x contact matrix of values, zero if not messaged
+        values = np.zeros((len(keyframes), len(names)))
+        values[keyIdx, nameCodes] = keyDF['value'].to_numpy()
+
+        # Rank 0 is the most messaged, anyone not shown sits just below
+        # the bottom bar, so they slide in and out from there
+        order = np.argsort(-values, axis=1, kind='stable')
+        ranks = np.empty_like(values)
+        np.put_along_axis(
+            ranks, order, np.arange(len(names))[None, :], axis=1)
+        shown = np.minimum((values > 0).sum(axis=1), maxShown)
+        ranks = np.where(
+            (values > 0) & (ranks < maxShown), ranks, shown[:, None])
+
+        # Blend each keyframe into the next over tweenFrames + 1 steps
+        steps = tweenFrames + 1
+        alphas = np.arange(steps) / steps
+        fromIdx = np.repeat(np.arange(len(keyframes) - 1), steps)
+        alpha = np.tile(alphas, len(keyframes) - 1)
+
+        # Finish on the final keyframe itself
+        fromIdx = np.append(fromIdx, len(keyframes) - 1)
+        alpha = np.append(alpha, 0.0)
+        toIdx = np.minimum(fromIdx + 1, len(keyframes) - 1)
+
+        def blend(matrix):
+            if matrix.ndim == 1:
+                return matrix[fromIdx] + \
+                    (matrix[toIdx] - matrix[fromIdx]) * alpha
+            return matrix[fromIdx] + \
+                (matrix[toIdx] - matrix[fromIdx]) * alpha[:, None]
+
+        tweenValues = blend(values)
+        tweenRanks = blend(ranks)
+        tweenShown = blend(shown.astype(float))
+
+        # Keep contacts on screen or sliding on or off it
+        frameIdx, contactIdx = np.nonzero(
+            (tweenRanks < maxShown) & (tweenValues > 0))
+
+        # Each contact keeps its group, and frames keep their keyframe dates
+        groupLookup = keyDF.drop_duplicates(subset=['name']).set_index(
+            'name')['group']
+        groups = [groupLookup[name] for name in names]
+        keyTimes = keyDF.drop_duplicates(subset=['frame'])
+
+        df = pd.DataFrame({
+            "frame": (frameIdx + 1).astype(np.int64),
+            "name": self.to_categorical(contactIdx, names),
+            "group": self.to_categorical(contactIdx, groups),
+            "value": tweenValues[frameIdx, contactIdx],
+            "rank": tweenRanks[frameIdx, contactIdx],
+            "shown": tweenShown[frameIdx],
+            "timeMin": self.to_categorical(
+                fromIdx[frameIdx], keyTimes['timeMin'].tolist()),
+            "timeMax": self.to_categorical(
+                fromIdx[frameIdx], keyTimes['timeMax'].tolist())
+        })
+
+        return df
+
+    def to_categorical(self, codes, values):
+        # Labels may repeat (months, groups), so map codes onto the
+        # unique labels first
+        labelCodes, labels = pd.factorize(pd.Series(list(values), dtype=object))
+        return pd.Categorical.from_codes(labelCodes[codes], labels)
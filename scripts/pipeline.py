@@ -0,0 +1,63 @@
+###################################
+# pipeline.py
+###################################
+"""
+Author: Matt Balshaw
+Start Date: 18/10/2026
+
+The stages of the full analysis, with what each one needs and makes
+Every registered analysis only needs the processed data, so they can all
+run at the same time once processing is done
+"""
+
+from functools import partial
+
+from scripts.unzipper import ZipFuncs
+from scripts.processor import ProcessorFuncs
+from scripts.analyses import analyses
+
+
+def run_unzip(config, dataset):
+    if config.get('streamZip', False):
+        ZipFuncs().run_stream_check(config)
+    else:
+        ZipFuncs().run_unzip_process(config)
+
+
+def run_processing(config, dataset):
+    ProcessorFuncs().run_processing(config)
+
+
+def run_analysis(analysis, config, dataset):
+    analysis().run(config, dataset)
+
+
+def pipeline_stages():
+    stages = [
+        {
+            "name": "unzip",
+            "title": "Unzipping Data",
+            "inputs": ["zipFile"],
+            "outputs": ["rawData"],
+            "run": run_unzip
+        },
+        {
+            "name": "processing",
+            "title": "Processing Data",
+            "inputs": ["rawData"],
+            "outputs": ["processedData"],
+            "run": run_processing
+        }
+    ]
+
+    for analysis in analyses:
+        stages.append({
+            "name": analysis.stage,
+            "title": "Generating " + analysis.title,
+            "inputs": ["processedData"],
+            "outputs": [analysis.stage],
+            "tables": analysis.tables,
+            "run": partial(run_analysis, analysis)
+        })
+
+    return stages
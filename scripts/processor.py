@@ -5,17 +5,37 @@
 Author: Matt Balshaw
 Start Date: 10/06/2020
 
-Processes the raw facebook data into usable csv's
+Processes the raw facebook data into usable message and contact tables
+Group chats are kept too, in normalized thread, participant and sender
+tables, with each message keyed by its thread and sender
 """
 
 import pandas as pd
+import numpy as np
 import os
 import json
 import sys
 from tqdm import tqdm
-from pathlib import Path
 import re
-import ftfy
+import time
+import zlib
+from dateutil import tz
+from zipfile import ZipFile
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+
+from scripts.unzipper import ZipFuncs
+from scripts.datastore import DataStoreFuncs
+from scripts.stagecache import StageCacheFuncs
+from scripts.dailycube import DailyCubeFuncs
+from scripts.textfix import fix_text
+from scripts.jsonparser import JsonFuncs
+from scripts.spillsort import SpillSortFuncs
+from scripts import instrument
+
+
+# Emoji code points, flags and symbols count one per code point
+emojiPattern = '[\U0001F1E6-\U0001F1FF\U0001F300-\U0001FAFF\u2600-\u27BF]'
 
 
 class ProcessorFuncs():
@@ -24,13 +44,31 @@ class ProcessorFuncs():
         processedLoc = "processed-data/" + config['zipFile'] + "/"
         rawLoc = "raw-data/" + config['zipFile']
 
+        # Read the conversations straight out of the zip when streaming
+        if config.get('streamZip', False):
+            rawLoc = "facebook-zips/" + config['zipFile'] + ".zip"
+
+        # The raw data always comes from the zip, so key on the
+        # conversations in it
+        zipLoc = "facebook-zips/" + config['zipFile'] + ".zip"
+        cache = StageCacheFuncs(config)
+        stageKey = cache.stage_key(
+            [], self.stage_config(config),
+            {zipLoc: ZipFuncs().fingerprint_zip(zipLoc)})
+
         # Check if file exists
         doesExist, errorMessage = self.check_processed(processedLoc)
         if not doesExist or config['debug']:
             print(errorMessage)
-            self.process_data(rawLoc, processedLoc, config['myName'])
-        else:
+            self.process_data(rawLoc, processedLoc, config)
+        elif cache.is_fresh('processing', stageKey):
             print("♻ Using existing processed data")
+        elif config.get('incremental', False):
+            print("Checking for new or changed conversations")
+            self.process_data(rawLoc, processedLoc, config, incremental=True)
+        else:
+            print("Export or config has changed, processing again")
+            self.process_data(rawLoc, processedLoc, config)
 
         doesExist, errorMessage = self.check_processed(processedLoc)
         if not doesExist:
@@ -38,26 +76,730 @@ class ProcessorFuncs():
             print("☠ Critical error, exiting...")
             sys.exit()
         else:
+            cache.record('processing', stageKey)
             print("✓ Processing success")
 
+    def stage_config(self, config):
+        # Only the settings which change the processed data
+        return {
+            "myName": config['myName'],
+            "processedFormat": config.get('processedFormat', 'parquet'),
+            "exportCsv": config.get('exportCsv', False),
+            "schemaVersion": DataStoreFuncs.schemaVersion
+        }
+
     def check_processed(self, loc):
         # Ensure that the directory exists and is correct
+        return DataStoreFuncs().check_processed(loc)
 
-        contactLoc = loc + "contactData.csv"
-        messagesLoc = loc + "allMessageData.csv"
+    def process_data(self, rawLoc, processedLoc, config, incremental=False):
+        # Create the thread, contact and message dataframes
+        # When incremental, only changed conversations are reprocessed and
+        # merged into the existing processed data
+        myName = config['myName']
+        workers = config.get('processingWorkers', 1)
+        parser = JsonFuncs().get_parser(config)
 
-        if not os.path.exists(contactLoc):
-            return False, "No contact file found"
+        print("Gathering message files...")
 
-        if not os.path.exists(messagesLoc):
-            return False, "No Message file found"
+        with instrument.step("gatherFiles"):
+            messageFiles = self.gather_message_files(rawLoc)
+            instrument.add_rows(len(messageFiles))
+
+        manifest = None
+        replacedContacts = None
+        if config.get('incremental', False):
+            with instrument.step("manifest"):
+                manifest = self.build_manifest(
+                    messageFiles, processedLoc, myName)
+
+                if incremental:
+                    messageFiles, replacedContacts = \
+                        self.find_changed_files(
+                            messageFiles, manifest, processedLoc)
+
+        if incremental:
+            if replacedContacts is None:
+                print("Existing data can't be reused, processing everything")
+            elif len(replacedContacts) == 0:
+                print("♻ No conversations have changed")
+                self.save_manifest(processedLoc, manifest)
+                return
+            else:
+                print("Reprocessing %s changed conversations" %
+                      len(replacedContacts))
+
+        parsed = tqdm(
+            self.parse_all(messageFiles, myName, workers, parser),
+            total=len(messageFiles))
+
+        if config.get('streamProcessing', False):
+            self.process_streaming(
+                processedLoc, config, parsed, replacedContacts)
+        else:
+            self.process_in_memory(
+                processedLoc, config, parsed, replacedContacts)
 
-        return True, "Found processed data"
+        if manifest is not None:
+            self.save_manifest(processedLoc, manifest)
 
-    def process_data(self, rawLoc, processedLoc, myName):
-        # Create a contact dataframe and message dataframe
+        self.close_zips()
 
-        print("Gathering message files...")
+    def process_in_memory(self, processedLoc, config, parsed,
+                          replacedContacts):
+        # Accumulate every column as a plain list and build the dataframes
+        # once at the end, rather than appending a dataframe per file
+        threads = {}
+        messageColumns = self.new_message_columns()
+
+        print("Filtering messages and creating dataframes...")
+
+        # Now for each file, load file
+        # Get file contact name
+        # put all messages in messageList
+        # Determine if message was a conversation starter
+        with instrument.step("parse"):
+            for thread, newColumns in parsed:
+
+                if thread is None:
+                    continue
+
+                self.add_thread(threads, thread)
+                self.add_message_columns(messageColumns, thread, newColumns)
+                instrument.add_rows(len(newColumns['timestamp_ms']))
+
+        with instrument.step("buildFrames"):
+            threadDF, participantDF = self.thread_frames(threads)
+            allMessagesDF = self.build_messages(messageColumns)
+            instrument.add_rows(len(allMessagesDF))
+
+        if replacedContacts is not None:
+            with instrument.step("mergeExisting"):
+                threadDF, participantDF, allMessagesDF = self.merge_existing(
+                    processedLoc, replacedContacts, threadDF, participantDF,
+                    allMessagesDF)
+
+        # Now sort the dataframes
+        with instrument.step("sort"):
+            threadDF = threadDF.sort_values(
+                by=['messages'], ascending=False, kind='stable')
+            allMessagesDF = allMessagesDF.sort_values(
+                by=['timestamp_ms'], ascending=True, kind='stable')
+            instrument.add_rows(len(allMessagesDF))
+
+        with instrument.step("encode"):
+            threadDF, participantDF, senderDF = self.encode_thread_tables(
+                threadDF, participantDF, set(allMessagesDF['sender']))
+            allMessagesDF = self.encode_messages(
+                allMessagesDF, threadDF, senderDF)
+            instrument.add_rows(len(allMessagesDF))
+
+        # Save the files
+        store = DataStoreFuncs()
+        with instrument.step("write"):
+            self.write_thread_tables(
+                processedLoc, config, threadDF, participantDF, senderDF,
+                len(allMessagesDF))
+            store.write_table(
+                processedLoc, "messages", allMessagesDF, config)
+            instrument.add_rows(len(allMessagesDF))
+
+        print("Building daily message cube...")
+        with instrument.step("cube"):
+            cubeDF = DailyCubeFuncs().build_cube(allMessagesDF)
+            store.write_table(processedLoc, "cube", cubeDF, config)
+            instrument.add_rows(len(allMessagesDF))
+
+    def process_streaming(self, processedLoc, config, parsed,
+                          replacedContacts):
+        # Spills the parsed messages to disk as sorted runs, then merges
+        # them in timestamp order while writing the tables a chunk at a
+        # time, so memory stays within the budget however big the export
+        store = DataStoreFuncs()
+        cubeFuncs = DailyCubeFuncs()
+        spill = SpillSortFuncs(processedLoc + "spill/", 'timestamp_ms')
+
+        # Half the budget holds parsed messages before they are spilled
+        spillBytes = config.get('memoryBudgetMB', 512) * 1024 * 1024 // 2
+
+        threads = {}
+        senders = set()
+        messageColumns = self.new_message_columns()
+        bufferBytes = 0
+
+        # Existing messages are already in order, so they are read back
+        # during the merge rather than spilled again
+        if replacedContacts is not None:
+            oldThreadDF, oldParticipantDF, oldContactIDs, senderNames = \
+                self.load_existing_threads(processedLoc, replacedContacts)
+            oldRows, oldSenders = self.scan_existing(
+                processedLoc, replacedContacts, oldContactIDs, senderNames)
+            senders.update(oldSenders)
+            spill.add_sorted(lambda: self.existing_messages(
+                processedLoc, replacedContacts, oldContactIDs, senderNames),
+                oldRows)
+
+        print("Filtering messages and spilling sorted runs...")
+
+        with instrument.step("parse"):
+            for thread, newColumns in parsed:
+
+                if thread is None:
+                    continue
+
+                self.add_thread(threads, thread)
+                self.add_message_columns(messageColumns, thread, newColumns)
+                senders.update(newColumns['sender'])
+                instrument.add_rows(len(newColumns['timestamp_ms']))
+
+                # Rough size of the rows while they are held in python lists
+                bufferBytes += 250 * len(newColumns['timestamp_ms']) + \
+                    sum(map(len, newColumns['content']))
+
+                if bufferBytes > spillBytes:
+                    self.spill_run(spill, messageColumns)
+                    messageColumns = self.new_message_columns()
+                    bufferBytes = 0
+
+            if len(messageColumns['timestamp_ms']) > 0:
+                self.spill_run(spill, messageColumns)
+
+        with instrument.step("encodeThreads"):
+            threadDF, participantDF = self.thread_frames(threads)
+            if replacedContacts is not None:
+                threadDF = pd.concat(
+                    [oldThreadDF, threadDF], ignore_index=True)
+                participantDF = pd.concat(
+                    [oldParticipantDF, participantDF], ignore_index=True)
+
+            threadDF = threadDF.sort_values(
+                by=['messages'], ascending=False, kind='stable')
+
+            threadDF, participantDF, senderDF = self.encode_thread_tables(
+                threadDF, participantDF, senders)
+
+        print("Merging %s sorted runs..." % len(spill.sources))
+
+        writer = store.open_writer(processedLoc, "messages", config)
+        cubes = []
+
+        with instrument.step("mergeRuns"), tqdm(total=spill.rows) as pbar:
+            mergeStart = time.perf_counter()
+            for chunkDF in spill.merge():
+                stepStart = time.perf_counter()
+                instrument.add_time(
+                    "sort", stepStart - mergeStart, rows=len(chunkDF))
+
+                chunkDF = self.encode_messages(chunkDF, threadDF, senderDF)
+                encodeEnd = time.perf_counter()
+                instrument.add_time(
+                    "encode", encodeEnd - stepStart, rows=len(chunkDF))
+
+                writer.write(chunkDF)
+                writeEnd = time.perf_counter()
+                instrument.add_time(
+                    "write", writeEnd - encodeEnd, rows=len(chunkDF))
+
+                cubes.append(cubeFuncs.build_cube(chunkDF))
+                pbar.update(len(chunkDF))
+                instrument.add_rows(len(chunkDF))
+                mergeStart = time.perf_counter()
+                instrument.add_time(
+                    "cube", mergeStart - writeEnd, rows=len(chunkDF))
+
+        # Still write empty tables if there were no messages
+        if writer.rows == 0:
+            chunkDF = self.encode_messages(
+                self.build_messages(self.new_message_columns()),
+                threadDF, senderDF)
+            writer.write(chunkDF)
+            cubes.append(cubeFuncs.build_cube(chunkDF))
+
+        writer.close()
+        spill.cleanup()
+
+        self.write_thread_tables(
+            processedLoc, config, threadDF, participantDF, senderDF,
+            writer.rows)
+
+        print("Building daily message cube...")
+        with instrument.step("cube"):
+            store.write_table(
+                processedLoc, "cube", cubeFuncs.combine_cubes(cubes), config)
+
+    def spill_run(self, spill, messageColumns):
+        spillStart = time.perf_counter()
+        runDF = self.build_messages(messageColumns)
+        spill.add_run(runDF)
+        instrument.add_time(
+            "spill", time.perf_counter() - spillStart, rows=len(runDF))
+
+    def new_message_columns(self):
+        # Rows only hold their thread's contactID until it is swapped for
+        # an integer key, the rest of the thread lives in the threads table
+        return {
+            "contactID": [],
+            "received": [],
+            "timestamp_ms": [],
+            "content": [],
+            "type": [],
+            "startedConv": [],
+            "sender": []
+        }
+
+    def add_thread(self, threads, thread):
+        # Multiple files for one thread sum their message counts
+        if thread['contactID'] in threads:
+            threads[thread['contactID']]['messages'] += thread['messages']
+            for participant in thread['participants']:
+                if participant not in \
+                        threads[thread['contactID']]['participants']:
+                    threads[thread['contactID']]['participants'].append(
+                        participant)
+        else:
+            threads[thread['contactID']] = thread
+
+    def add_message_columns(self, messageColumns, thread, newColumns):
+        messageColumns['contactID'].extend(
+            [thread['contactID']] * len(newColumns['timestamp_ms']))
+        for column in newColumns:
+            messageColumns[column].extend(newColumns[column])
+
+    def build_messages(self, messageColumns):
+        messageColumns['contactID'] = pd.Categorical(
+            messageColumns['contactID'])
+        messageColumns['sender'] = pd.Categorical(messageColumns['sender'])
+        allMessagesDF = pd.DataFrame(messageColumns)
+
+        return self.add_message_features(allMessagesDF)
+
+    def thread_frames(self, threads):
+        threadDF = pd.DataFrame(
+            list(threads.values()),
+            columns=["contactID", "name", "isGroup", "messages"])
+        participantDF = pd.DataFrame([
+            {"contactID": contactID, "name": participant}
+            for contactID, thread in threads.items()
+            for participant in thread['participants']
+        ], columns=["contactID", "name"])
+
+        return threadDF, participantDF
+
+    def write_thread_tables(self, processedLoc, config, threadDF,
+                            participantDF, senderDF, messageCount):
+        # Contacts are the people in one to one threads
+        contactDF = threadDF.loc[
+            ~threadDF['isGroup'], ["contactID", "name", "messages"]]
+
+        print("Processed %s contacts, %s group chats and %s messages" %
+              (len(contactDF), threadDF['isGroup'].sum(), messageCount))
+
+        store = DataStoreFuncs()
+        store.write_table(processedLoc, "contacts", contactDF, config)
+        store.write_table(processedLoc, "threads", threadDF, config)
+        store.write_table(processedLoc, "participants", participantDF, config)
+        store.write_table(processedLoc, "senders", senderDF, config)
+
+    def encode_thread_tables(self, threadDF, participantDF, messageSenders):
+        # Number threads and senders with small integer keys, so group
+        # chats don't repeat every sender's name on every message
+        threadDF = threadDF.reset_index(drop=True)
+        threadDF.insert(
+            0, 'threadID', np.arange(len(threadDF), dtype='int32'))
+        threadDF['participantCount'] = threadDF['contactID'].map(
+            participantDF['contactID'].value_counts()).fillna(0).astype(
+            'int16')
+
+        senderNames = pd.Index(sorted(
+            set(participantDF['name']) | set(messageSenders)))
+        senderDF = pd.DataFrame({
+            "senderID": np.arange(len(senderNames), dtype='int32'),
+            "name": senderNames
+        })
+
+        threadIDs = pd.Index(threadDF['contactID'])
+        participantDF = pd.DataFrame({
+            "threadID": threadIDs.get_indexer(
+                participantDF['contactID']).astype('int32'),
+            "senderID": senderNames.get_indexer(
+                participantDF['name']).astype('int32')
+        }).sort_values(by=['threadID', 'senderID']).reset_index(drop=True)
+
+        return threadDF, participantDF, senderDF
+
+    def encode_messages(self, allMessagesDF, threadDF, senderDF):
+        # Messages keep only the keys, threadID is the row in threadDF
+        threadIDs = pd.Index(threadDF['contactID'])
+        senderNames = pd.Index(senderDF['name'])
+
+        allMessagesDF.insert(0, 'threadID', threadIDs.get_indexer(
+            allMessagesDF['contactID']).astype('int32'))
+        allMessagesDF.insert(1, 'senderID', senderNames.get_indexer(
+            allMessagesDF['sender']).astype('int32'))
+
+        return allMessagesDF.drop(columns=['contactID', 'sender'])
+
+    def add_message_features(self, allMessagesDF):
+        # Precompute per message features, so analyses never need to load
+        # the content column
+        content = allMessagesDF['content'].fillna("")
+
+        allMessagesDF['len'] = content.str.len().astype('int32')
+        allMessagesDF['wordCount'] = content.str.count(
+            '\\S+').astype('int32')
+        allMessagesDF['emojiCount'] = content.str.count(
+            emojiPattern).astype('int16')
+
+        # Hours and weekdays are in the local timezone, like the graphs
+        # The local zone file lets pandas convert them all at once, where
+        # tzlocal is converted one timestamp at a time
+        localZone = tz.gettz() or tz.tzlocal()
+        localTimes = pd.to_datetime(
+            allMessagesDF['timestamp_ms'], unit='ms', utc=True
+        ).dt.tz_convert(localZone)
+        allMessagesDF['hour'] = localTimes.dt.hour.astype('int8')
+        allMessagesDF['weekday'] = localTimes.dt.weekday.astype('int8')
+
+        # Start of the local day in ms, for grouping messages by day
+        dayStarts = localTimes.dt.normalize().dt.tz_convert('UTC')
+        allMessagesDF['day_ms'] = (
+            dayStarts - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(1, 'ms')
+
+        return allMessagesDF
+
+    def build_manifest(self, messageFiles, processedLoc, myName):
+        # Fingerprint every conversation file so later runs can tell
+        # which ones have changed
+        previous = self.load_manifest(processedLoc)
+        previousFiles = {}
+        if previous is not None:
+            previousFiles = previous['files']
+
+        manifest = {
+            "myName": myName,
+            "schemaVersion": DataStoreFuncs.schemaVersion,
+            "files": {}
+        }
+
+        print("Fingerprinting message files...")
+        for messageFile in tqdm(messageFiles):
+            key = self.manifest_key(messageFile)
+            manifest['files'][key] = self.fingerprint_file(
+                messageFile, previousFiles.get(key))
+
+        return manifest
+
+    def manifest_key(self, messageFile):
+        # Key files by their path inside the export, so raw-data and zip
+        # runs share a manifest
+        path = messageFile['path'].replace(os.sep, '/')
+        return path[path.index('messages/inbox/'):]
+
+    def fingerprint_file(self, messageFile, previous):
+        fingerprint = {
+            "contactID": messageFile['contactID']
+        }
+
+        # Zip members come with their size and checksum
+        if 'zipFile' in messageFile:
+            fingerprint['size'] = messageFile['size']
+            fingerprint['hash'] = messageFile['hash']
+            return fingerprint
+
+        stat = os.stat(messageFile['path'])
+        fingerprint['size'] = stat.st_size
+        fingerprint['mtime'] = stat.st_mtime
+
+        # Skip hashing when the size and modified time are unchanged
+        if previous is not None and previous.get('size') == stat.st_size \
+                and previous.get('mtime') == stat.st_mtime:
+            fingerprint['hash'] = previous['hash']
+            return fingerprint
+
+        # Same checksum the zip stores, so extracted and streamed runs match
+        crc = 0
+        with open(messageFile['path'], "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                crc = zlib.crc32(block, crc)
+        fingerprint['hash'] = "crc32:%08x" % crc
+
+        return fingerprint
+
+    def find_changed_files(self, messageFiles, manifest, processedLoc):
+        # Returns the files to reprocess and the contactIDs they replace
+        # The contacts are None if everything has to be reprocessed
+        previous = self.load_manifest(processedLoc)
+
+        # The whole store is rebuilt if its columns would change
+        if previous is None or previous['myName'] != manifest['myName'] or \
+                previous.get('schemaVersion') != manifest['schemaVersion']:
+            return messageFiles, None
+
+        # A conversation is redone if any of its files changed
+        # and is dropped if it is no longer in the export
+        replacedContacts = set()
+        for key, fingerprint in manifest['files'].items():
+            old = previous['files'].get(key)
+            if old is None or old['size'] != fingerprint['size'] or \
+                    old['hash'] != fingerprint['hash']:
+                replacedContacts.add(fingerprint['contactID'])
+
+        for key, fingerprint in previous['files'].items():
+            if key not in manifest['files']:
+                replacedContacts.add(fingerprint['contactID'])
+
+        changedFiles = [
+            messageFile for messageFile in messageFiles
+            if messageFile['contactID'] in replacedContacts
+        ]
+
+        return changedFiles, replacedContacts
+
+    def merge_existing(self, processedLoc, replacedContacts, threadDF,
+                       participantDF, allMessagesDF):
+        # Swap the replaced conversations in the existing data for the
+        # newly processed ones
+        oldThreadDF, oldParticipantDF, oldContactIDs, senderNames = \
+            self.load_existing_threads(processedLoc, replacedContacts)
+
+        oldMessagesDF = DataStoreFuncs().read_messages(processedLoc)
+        oldMessagesDF = self.decode_messages(
+            oldMessagesDF, oldContactIDs, senderNames)
+        oldMessagesDF = oldMessagesDF[
+            ~oldMessagesDF['contactID'].isin(replacedContacts)]
+
+        # Categories differ between the old and new data, so merge as text
+        threadDF = pd.concat([oldThreadDF, threadDF], ignore_index=True)
+        participantDF = pd.concat(
+            [oldParticipantDF, participantDF], ignore_index=True)
+        allMessagesDF = pd.concat([
+            oldMessagesDF,
+            allMessagesDF.astype({"contactID": str, "sender": str})
+        ], ignore_index=True)
+
+        return threadDF, participantDF, allMessagesDF
+
+    def load_existing_threads(self, processedLoc, replacedContacts):
+        # Reads the existing thread tables, minus the replaced threads
+        # The integer keys are rebuilt after merging, so the old ones are
+        # turned back into thread and sender names
+        store = DataStoreFuncs()
+        oldThreadDF = store.read_table(processedLoc, "threads")
+        oldParticipantDF = store.read_table(processedLoc, "participants")
+        senderNames = store.read_table(processedLoc, "senders")['name']
+
+        oldContactIDs = oldThreadDF['contactID'].astype(str).to_numpy()
+        senderNames = senderNames.astype(str).to_numpy()
+
+        oldParticipantDF = pd.DataFrame({
+            "contactID": oldContactIDs[oldParticipantDF['threadID']],
+            "name": senderNames[oldParticipantDF['senderID']]
+        })
+        oldThreadDF = oldThreadDF.drop(
+            columns=['threadID', 'participantCount']).astype(
+            {"contactID": str, "name": str})
+
+        oldThreadDF = oldThreadDF[
+            ~oldThreadDF['contactID'].isin(replacedContacts)]
+        oldParticipantDF = oldParticipantDF[
+            ~oldParticipantDF['contactID'].isin(replacedContacts)]
+
+        return oldThreadDF, oldParticipantDF, oldContactIDs, senderNames
+
+    def decode_messages(self, oldMessagesDF, oldContactIDs, senderNames):
+        # Swap the old integer keys for thread and sender names
+        oldMessagesDF = oldMessagesDF.drop(
+            columns=[c for c in DataStoreFuncs.threadColumns
+                     if c in oldMessagesDF.columns])
+        oldMessagesDF.insert(
+            0, 'contactID', oldContactIDs[oldMessagesDF['threadID']])
+        oldMessagesDF['sender'] = senderNames[oldMessagesDF['senderID']]
+
+        return oldMessagesDF.drop(columns=['threadID', 'senderID'])
+
+    def scan_existing(self, processedLoc, replacedContacts, oldContactIDs,
+                      senderNames):
+        # Counts the existing messages that are kept, and who sent them,
+        # reading only the key columns
+        rows = 0
+        senderIDs = set()
+        replaced = np.isin(oldContactIDs, list(replacedContacts))
+
+        for chunkDF in DataStoreFuncs().read_table_chunks(
+                processedLoc, "messages", SpillSortFuncs.blockRows * 16,
+                columns=['threadID', 'senderID']):
+            kept = ~replaced[chunkDF['threadID'].to_numpy()]
+            rows += kept.sum()
+            senderIDs.update(np.unique(chunkDF['senderID'].to_numpy()[kept]))
+
+        return rows, set(senderNames[list(senderIDs)])
+
+    def existing_messages(self, processedLoc, replacedContacts,
+                          oldContactIDs, senderNames):
+        # Yields the kept existing messages a block at a time
+        for chunkDF in DataStoreFuncs().read_table_chunks(
+                processedLoc, "messages", SpillSortFuncs.blockRows):
+            chunkDF = self.decode_messages(chunkDF, oldContactIDs, senderNames)
+            yield chunkDF[~chunkDF['contactID'].isin(replacedContacts)]
+
+    def load_manifest(self, processedLoc):
+        manifestLoc = processedLoc + "manifest.json"
+        if not os.path.exists(manifestLoc):
+            return None
+
+        with open(manifestLoc, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def save_manifest(self, processedLoc, manifest):
+        with open(processedLoc + "manifest.json", "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+
+    def parse_all(self, messageFiles, myName, workers, parser):
+        # Yields the parsed result of every file, in the same order as
+        # messageFiles so the merged output matches the serial path
+        if workers <= 1:
+            for messageFile in messageFiles:
+                yield self.load_conversation(messageFile, myName, parser)
+            return
+
+        print("Parsing with %s worker processes" % workers)
+
+        # Only a couple of files per worker are in flight at once, so
+        # parsed files never pile up waiting while the main loop is busy,
+        # like spilling a sorted run
+        # Each file is up to 10000 messages, so pickling a file at a time
+        # costs little next to parsing it
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for messageFile in messageFiles:
+                pending.append(executor.submit(
+                    parse_in_worker, messageFile, myName, parser,
+                    instrument.enabled))
+                if len(pending) >= workers * 2:
+                    yield self.finish_file(pending.popleft())
+
+            while pending:
+                yield self.finish_file(pending.popleft())
+
+    def finish_file(self, future):
+        # Workers send back their timings with each file
+        thread, newColumns, timings = future.result()
+        instrument.merge_timings(timings)
+        return thread, newColumns
+
+    def load_conversation(self, messageFile, myName, parser='json'):
+        readStart = time.perf_counter()
+        with self.open_message_file(messageFile) as f:
+            messages = JsonFuncs().load(f, parser)
+            instrument.add_time(
+                "readJson", time.perf_counter() - readStart,
+                rows=len(messages.get('messages', [])), size=f.tell())
+
+        return self.parse_conversation(
+            messages, messageFile['contactID'], myName)
+
+    def parse_conversation(self, messages, contactID, myName):
+        # Returns the thread and a dict of message columns for one file
+        # or None for the thread if the file should be skipped
+
+        # Fix terrible facebook unicode
+        participants = [
+            fix_text(participant['name'])
+            for participant in messages['participants']
+        ]
+
+        isGroup = len(participants) > 2 or \
+            messages.get('thread_type') == 'RegularGroup'
+
+        cName = "Unknown"
+        if isGroup:
+            # Group chats go by their title, or else their members
+            cName = fix_text(messages.get('title', ""))
+            if cName == "":
+                cName = ", ".join(
+                    name for name in participants if name != myName)
+        else:
+            # Ignore facebook user and myself
+            for participant in messages['participants']:
+                if participant['name'] == "Facebook User":
+                    continue
+                if participant['name'] != myName:
+                    cName = fix_text(participant['name'])
+
+        if cName == "Unknown":
+            return None, None
+
+        # Create thread
+        thread = {
+            "contactID": contactID,
+            "name": cName,
+            "isGroup": isGroup,
+            "messages": len(messages['messages']),
+            "participants": participants
+        }
+
+        receivedList = []
+        timestampsList = []
+        contentList = []
+        typeList = []
+        convoStartList = []
+        senderList = []
+
+        prevTime = 0
+        minConvoTime = (86400000) // 2  # 12 hours
+
+        # Create messages
+        for message in messages['messages']:
+
+            # Ignore gifs and links, only want text
+            if 'content' not in message:
+                continue
+            timestampsList.append(message['timestamp_ms'])
+            contentList.append(message['content'])
+            typeList.append(message['type'])
+            if message['sender_name'] == myName:
+                receivedList.append(0)
+            else:
+                receivedList.append(1)
+
+            senderList.append(message['sender_name'])
+
+            # Calculate if was conversation starter..
+            # If the message was sent more than 8 hours after previous one
+            # It is a convo starter
+            # NOTE: The jsons are ordered ascending as we go down them
+            # So, we must say if current is LESS than prev within
+            # tolerance
+            if message['timestamp_ms'] < (prevTime - minConvoTime) or prevTime == 0:
+                convoStartList.append(1)
+            else:
+                convoStartList.append(0)
+
+            prevTime = message['timestamp_ms']
+
+        # Fix terrible facebook unicode
+        fixStart = time.perf_counter()
+        contentList = list(map(fix_text, contentList))
+        senderList = list(map(fix_text, senderList))
+        instrument.add_time(
+            "fixText", time.perf_counter() - fixStart,
+            rows=len(contentList))
+
+        newMessages = {
+            "received": receivedList,
+            "timestamp_ms": timestampsList,
+            "content": contentList,
+            "type": typeList,
+            'startedConv': convoStartList,
+            "sender": senderList
+        }
+
+        return thread, newMessages
+
+    def gather_message_files(self, rawLoc):
+        # A zip path means we stream the jsons straight from the zip
+        if rawLoc[-4:] == ".zip":
+            return ZipFuncs().list_message_files(rawLoc)
 
         messageFiles = []
 
@@ -80,122 +822,41 @@ class ProcessorFuncs():
                         }
                         messageFiles.append(msgFile)
 
-        contactDF = pd.DataFrame()
-        allMessagesDF = pd.DataFrame()
+        return messageFiles
 
-        print("Filtering messages and creating dataframes...")
-
-        # Now for each file, load file
-        # Get file contact name
-        # put all messages in messageList
-        # Determine if message was a conversation starter
-        for messageFile in tqdm(messageFiles):
-            with open(messageFile['path'], "r", encoding="utf-8") as f:
-                messages = json.load(f)
-                # Ignore group chats
-                if len(messages['participants']) > 2:
-                    continue
+    def open_message_file(self, messageFile):
+        if 'zipFile' not in messageFile:
+            return open(messageFile['path'], "rb")
 
-                contactID = messageFile['contactID']
+        # Keep each zip open so we don't re-read the central directory
+        # for every conversation
+        if not hasattr(self, 'openZips'):
+            self.openZips = {}
+        if messageFile['zipFile'] not in self.openZips:
+            self.openZips[messageFile['zipFile']] = ZipFile(
+                file=messageFile['zipFile'])
 
-                # Ignore facebook user and myself
-                cName = "Unknown"
-                for participant in messages['participants']:
-                    if participant['name'] == "Facebook User":
-                        continue
-                    if participant['name'] != myName:
-                        # Use ftfy to fix terrible facebook unicode
-                        cName = ftfy.fix_text(participant['name'])
+        return self.openZips[messageFile['zipFile']].open(messageFile['path'])
 
-                if cName == "Unknown":
-                    continue
+    def close_zips(self):
+        for zip_file in getattr(self, 'openZips', {}).values():
+            zip_file.close()
+        self.openZips = {}
 
-                # Create contact
-                newContact = {
-                    "contactID": [contactID],
-                    "name": [cName],
-                    "messagepart": [len(messages['messages'])],
-                }
-                newDF = pd.DataFrame(newContact)
-                contactDF = contactDF.append(newDF)
-
-                receivedList = []
-                timestampsList = []
-                contentList = []
-                typeList = []
-                pathList = []
-                nameList = []
-                convoStartList = []
-
-                prevTime = 0
-                minConvoTime = (86400000) // 2  # 12 hours
-
-                # Create messages
-                for message in messages['messages']:
-
-                    # Ignore gifs and links, only want text
-                    if 'content' not in message:
-                        continue
-                    timestampsList.append(message['timestamp_ms'])
-                    # Use ftfy to fix terrible facebook unicode
-                    contentList.append(ftfy.fix_text(message['content']))
-                    typeList.append(message['type'])
-                    pathList.append(contactID)
-                    nameList.append(cName)
-                    if message['sender_name'] == myName:
-                        receivedList.append(0)
-                    else:
-                        receivedList.append(1)
-
-                    # Calculate if was conversation starter..
-                    # If the message was sent more than 8 hours after previous one
-                    # It is a convo starter
-                    # NOTE: The jsons are ordered ascending as we go down them
-                    # So, we must say if current is LESS than prev within
-                    # tolerance
-                    # print(message['timestamp_ms'], (prevTime + minConvoTime),
-                    # str(message['timestamp_ms'] < (prevTime - minConvoTime)))
-                    if message['timestamp_ms'] < (prevTime - minConvoTime) or prevTime == 0:
-                        convoStartList.append(1)
-                    else:
-                        convoStartList.append(0)
-
-                    prevTime = message['timestamp_ms']
-
-                newMessages = {
-                    "contactID": pathList,
-                    "name": nameList,
-                    "received": receivedList,
-                    "timestamp_ms": timestampsList,
-                    "content": contentList,
-                    "type": typeList,
-                    'startedConv': convoStartList
-                }
-
-                newMessageDF = pd.DataFrame.from_dict(newMessages)
-                allMessagesDF = allMessagesDF.append(newMessageDF)
-
-        # now concatenate all the contacts
-        contactDF['messages'] = contactDF.groupby(
-            ['contactID'])['messagepart'].transform('sum')
-        contactDF = contactDF.drop_duplicates(subset=['contactID'])
-        contactDF = contactDF.drop(columns=["messagepart"])
 
-        # Now sort the dataframes
-        contactDF = contactDF.sort_values(by=['messages'], ascending=False)
-        allMessagesDF = allMessagesDF.sort_values(
-            by=['timestamp_ms'], ascending=True)
+# Each worker process keeps one ProcessorFuncs so open zips are reused
+workerFuncs = None
 
-        # Determine the filenames
-        contactLoc = processedLoc + 'contactData.csv'
-        messageLoc = processedLoc + 'allMessageData.csv'
 
-        # Ensure path exists
-        Path(processedLoc).mkdir(parents=True, exist_ok=True)
+def parse_in_worker(messageFile, myName, parser, instrumented):
+    global workerFuncs
+    if workerFuncs is None:
+        workerFuncs = ProcessorFuncs()
+        # Drop any timings copied from the parent when forked
+        instrument.enabled = instrumented
+        instrument.take_timings()
 
-        print("Processed %s contacts and %s messages" %
-              (len(contactDF), len(allMessagesDF)))
+    thread, newColumns = workerFuncs.load_conversation(
+        messageFile, myName, parser)
 
-        # Print the files
-        contactDF.to_csv(contactLoc)
-        allMessagesDF.to_csv(messageLoc)
+    return thread, newColumns, instrument.take_timings()
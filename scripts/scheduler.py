@@ -0,0 +1,172 @@
+###################################
+# scheduler.py
+###################################
+"""
+Author: Matt Balshaw
+Start Date: 18/10/2026
+
+Runs the pipeline stages in dependency order
+Each stage is a dict with a name, a title, the inputs it needs and the
+outputs it makes, and a run function taking the config and the dataset
+A stage starts once every stage making its inputs has finished, and with
+more than one worker, stages that are ready together run at the same time
+in their own processes
+"""
+
+import multiprocessing
+import traceback
+import queue
+import sys
+
+from scripts.dataset import ProcessedDataset
+from scripts import instrument
+
+
+class StageScheduler():
+
+    def __init__(self, stages, workers=1):
+        self.stages = stages
+        self.workers = workers
+        self.order = self.sort_stages()
+
+    def sort_stages(self):
+        # Orders the stages so each comes after the ones it depends on
+        makers = {}
+        for stage in self.stages:
+            for output in stage['outputs']:
+                if output in makers:
+                    raise ValueError("%s is made by both %s and %s" % (
+                        output, makers[output], stage['name']))
+                makers[output] = stage['name']
+
+        order = []
+        done = set()
+        remaining = list(self.stages)
+        while len(remaining) > 0:
+            ready = [stage for stage in remaining
+                     if self.is_ready(stage, done, makers)]
+            if len(ready) == 0:
+                raise ValueError("Stages depend on each other: %s" %
+                                 ", ".join(s['name'] for s in remaining))
+            for stage in ready:
+                order.append(stage)
+                remaining.remove(stage)
+                done.update(stage['outputs'])
+
+        self.makers = makers
+        return order
+
+    def is_ready(self, stage, done, makers):
+        # Inputs no stage makes, like the zip, are always there
+        return all(name in done or name not in makers
+                   for name in stage['inputs'])
+
+    def run(self, config):
+        if self.workers <= 1:
+            self.run_serial(config)
+        else:
+            self.run_parallel(config)
+
+    def run_serial(self, config):
+        # One dataset is shared by every stage, so each table is read once
+        dataset = ProcessedDataset(config)
+        for stage in self.order:
+            dataset.require(stage.get('tables', {}))
+
+        for stage in self.order:
+            print_title(stage)
+            with instrument.step(stage['name']):
+                stage['run'](config, dataset)
+
+    def run_parallel(self, config):
+        print("Running up to %s stages at once" % self.workers)
+
+        results = multiprocessing.Queue()
+        running = {}
+        done = set()
+        waiting = list(self.order)
+        failed = []
+
+        while len(waiting) > 0 or len(running) > 0:
+            # Start every stage that is ready, up to the limit
+            if len(failed) == 0:
+                for stage in list(waiting):
+                    if len(running) >= self.workers:
+                        break
+                    if not self.is_ready(stage, done, self.makers):
+                        continue
+                    waiting.remove(stage)
+                    print_title(stage)
+                    process = multiprocessing.Process(
+                        target=run_stage_process,
+                        args=(stage, config, instrument.enabled, results))
+                    process.start()
+                    running[stage['name']] = (stage, process)
+            elif len(running) == 0:
+                break
+
+            # Wait for any stage to finish
+            name, succeeded, report = self.wait_for_stage(results, running)
+            stage, process = running.pop(name)
+            process.join()
+
+            if instrument.recorder is not None:
+                instrument.recorder.report['stages'].extend(report)
+
+            if succeeded and process.exitcode == 0:
+                done.update(stage['outputs'])
+            else:
+                failed.append(name)
+
+        if len(failed) > 0:
+            print("☠ %s failed, exiting..." % ", ".join(failed))
+            sys.exit(1)
+
+    def wait_for_stage(self, results, running):
+        # A stage killed outright never sends its result, so keep an eye
+        # on whether each one is still alive
+        while True:
+            try:
+                return results.get(timeout=1)
+            except queue.Empty:
+                pass
+
+            for name, (stage, process) in running.items():
+                if not process.is_alive():
+                    try:
+                        return results.get(timeout=1)
+                    except queue.Empty:
+                        return name, False, []
+
+
+def print_title(stage):
+    print("##############################")
+    print("# " + stage['title'])
+    print("##############################")
+
+
+def run_stage_process(stage, config, instrumented, results):
+    # Runs one stage in its own process, sending back whether it worked
+    # and the timings of its steps
+    if instrumented:
+        instrument.start_run(config)
+
+    dataset = ProcessedDataset(config)
+    dataset.require(stage.get('tables', {}))
+
+    succeeded = False
+    try:
+        with instrument.step(stage['name']):
+            stage['run'](config, dataset)
+        succeeded = True
+    except SystemExit:
+        # The stage has already said what went wrong
+        pass
+    except Exception:
+        traceback.print_exc()
+
+    report = []
+    if instrument.recorder is not None:
+        report = instrument.recorder.report['stages']
+
+    results.put((stage['name'], succeeded, report))
@@ -0,0 +1,137 @@
+###################################
+# spillsort.py
+###################################
+"""
+Author: Matt Balshaw
+Start Date: 18/10/2026
+
+External merge sort for tables too big to sort in memory
+Rows are spilled to disk as sorted runs, then the runs are merged back
+in order a block at a time, so only a block of each run is ever held
+Ties keep the order the rows were added in, like a stable sort
+"""
+
+import pandas as pd
+import numpy as np
+import pickle
+import shutil
+import os
+from pathlib import Path
+
+
+class SpillSortFuncs():
+
+    # Rows per block read back from each run
+    blockRows = 8192
+
+    def __init__(self, spillLoc, sortColumn):
+        self.spillLoc = spillLoc
+        self.sortColumn = sortColumn
+        self.sources = []
+        self.rows = 0
+
+        # Clear out anything left by a run that didn't finish
+        if os.path.exists(spillLoc):
+            shutil.rmtree(spillLoc)
+        Path(spillLoc).mkdir(parents=True, exist_ok=True)
+
+    def add_run(self, runDF):
+        # Sort the rows and spill them to disk as blocks
+        runDF = runDF.sort_values(
+            by=[self.sortColumn], kind='stable').reset_index(drop=True)
+
+        runLoc = self.spillLoc + "run_%05d.pkl" % len(self.sources)
+        with open(runLoc, "wb") as f:
+            for start in range(0, len(runDF), self.blockRows):
+                pickle.dump(
+                    runDF.iloc[start:start + self.blockRows], f,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+
+        self.sources.append(lambda: self.read_run(runLoc))
+        self.rows += len(runDF)
+
+    def add_sorted(self, blocks, rows):
+        # Adds rows which are already sorted, as a function returning an
+        # iterator of blocks, so they are read straight from where they are
+        self.sources.append(blocks)
+        self.rows += rows
+
+    def read_run(self, runLoc):
+        with open(runLoc, "rb") as f:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    return
+
+    def merge(self):
+        # Yields the rows of every run in order, a chunk at a time
+        # Rows before the smallest last value in any run's current block
+        # can't be beaten by a later block, so they are ready to go out
+        sources = [blocks() for blocks in self.sources]
+        buffers = [None] * len(sources)
+        finished = [False] * len(sources)
+
+        # Small pieces are held back until there is at least a block
+        pending = []
+        pendingRows = 0
+
+        while True:
+            for i, source in enumerate(sources):
+                while not finished[i] and \
+                        (buffers[i] is None or len(buffers[i]) == 0):
+                    buffers[i] = self.next_block(source, finished, i)
+
+            active = [i for i in range(len(sources)) if not finished[i]]
+            if len(active) == 0:
+                bound = None
+            else:
+                bound = min(
+                    buffers[i][self.sortColumn].iloc[-1] for i in active)
+
+            ready = []
+            for i, buffer in enumerate(buffers):
+                if buffer is None or len(buffer) == 0:
+                    continue
+                if bound is None:
+                    cut = len(buffer)
+                else:
+                    cut = np.searchsorted(
+                        buffer[self.sortColumn].to_numpy(), bound,
+                        side='left')
+                if cut > 0:
+                    ready.append(buffer.iloc[:cut])
+                    buffers[i] = buffer.iloc[cut:]
+
+            if len(ready) > 0:
+                # A stable sort keeps ties in run order
+                chunkDF = pd.concat(ready, ignore_index=True)
+                pending.append(chunkDF.sort_values(
+                    by=[self.sortColumn], kind='stable'))
+                pendingRows += len(chunkDF)
+
+            if pendingRows >= self.blockRows or \
+                    (bound is None and pendingRows > 0):
+                yield pd.concat(pending, ignore_index=True)
+                pending = []
+                pendingRows = 0
+
+            if bound is None:
+                return
+
+            # Runs holding back the bound need their next block
+            for i in active:
+                if buffers[i][self.sortColumn].iloc[-1] == bound:
+                    nextBlock = self.next_block(sources[i], finished, i)
+                    if nextBlock is not None:
+                        buffers[i] = pd.concat(
+                            [buffers[i], nextBlock], ignore_index=True)
+
+    def next_block(self, source, finished, i):
+        block = next(source, None)
+        if block is None:
+            finished[i] = True
+        return block
+
+    def cleanup(self):
+        shutil.rmtree(self.spillLoc, ignore_errors=True)
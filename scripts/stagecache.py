@@ -0,0 +1,113 @@
+###################################
+# stagecache.py
+###################################
+"""
+Author: Matt Balshaw
+Start Date: 18/10/2026
+
+Decides whether a pipeline stage needs to run again
+Each stage is keyed on the hash of its input files plus the part of the
+config it uses, so only stages whose inputs or settings changed are rerun
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+
+class StageCacheFuncs():
+
+    def __init__(self, config):
+        # Each stage saves to its own file, so stages finishing at the same
+        # time in different processes never lose each other's keys
+        self.cacheLoc = "processed-data/" + config['zipFile'] + \
+            "/stagecache/"
+        self.cache = self.load_cache()
+
+    def load_cache(self):
+        # Gather the keys and file hashes saved by every stage
+        cache = {"stages": {}, "files": {}}
+        if not os.path.exists(self.cacheLoc):
+            return cache
+
+        for name in sorted(os.listdir(self.cacheLoc)):
+            if not name.endswith(".json"):
+                continue
+            with open(self.cacheLoc + name, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            cache['stages'][name[:-len(".json")]] = saved['key']
+            cache['files'].update(saved['files'])
+
+        return cache
+
+    def save_stage(self, stage):
+        Path(self.cacheLoc).mkdir(parents=True, exist_ok=True)
+
+        # Write beside and swap it in, so it is never read half written
+        stageLoc = self.cacheLoc + stage + ".json"
+        partialLoc = "%s.%s" % (stageLoc, os.getpid())
+        with open(partialLoc, "w", encoding="utf-8") as f:
+            json.dump({
+                "key": self.cache['stages'][stage],
+                "files": self.cache['files']
+            }, f, indent=4)
+        os.replace(partialLoc, stageLoc)
+
+    def hash_file(self, loc):
+        # Hashing a large export is slow, so reuse the last hash while the
+        # size and modified time are unchanged
+        stat = os.stat(loc)
+        known = self.cache['files'].get(loc)
+        if known is not None and known['size'] == stat.st_size and \
+                known['mtime'] == stat.st_mtime:
+            return known['hash']
+
+        sha = hashlib.sha1()
+        with open(loc, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha.update(block)
+
+        self.cache['files'][loc] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "hash": sha.hexdigest()
+        }
+
+        return sha.hexdigest()
+
+    def stage_key(self, inputs, stageConfig, hashedInputs=None):
+        # Combine the input file hashes and the stage config into one key
+        # Inputs with a cheaper fingerprint than hashing the whole file,
+        # like the conversations in a zip, are passed in already hashed
+        sha = hashlib.sha1()
+
+        for loc in inputs:
+            sha.update(loc.encode("utf-8"))
+            if os.path.exists(loc):
+                sha.update(self.hash_file(loc).encode("utf-8"))
+
+        for loc, fileHash in sorted((hashedInputs or {}).items()):
+            sha.update(loc.encode("utf-8"))
+            if fileHash is not None:
+                sha.update(fileHash.encode("utf-8"))
+
+        sha.update(json.dumps(stageConfig, sort_keys=True).encode("utf-8"))
+
+        return sha.hexdigest()
+
+    def is_fresh(self, stage, key, outputs=()):
+        # A stage is fresh if it last ran with the same key and its outputs
+        # are still there
+        if self.cache['stages'].get(stage) != key:
+            return False
+
+        for loc in outputs:
+            if not os.path.exists(loc):
+                return False
+
+        return True
+
+    def record(self, stage, key):
+        self.cache['stages'][stage] = key
+        self.save_stage(stage)
@@ -0,0 +1,172 @@
+###################################
+# synthetic.py
+###################################
+"""
+Author: Matt Balshaw
+Start Date: 18/10/2026
+
+Generates made up facebook exports of any size for benchmarking
+Uses the same name and sentence generators as scrambleexample.py, and
+writes zips laid out like the real download, down to facebook's broken
+unicode and splitting long conversations over several files
+"""
+
+import names
+from essential_generators import DocumentGenerator
+from zipfile import ZipFile, ZIP_DEFLATED
+from pathlib import Path
+from tqdm import tqdm
+import random
+import json
+import os
+
+
+class SyntheticFuncs():
+
+    # Facebook splits conversations into files of this many messages
+    messagesPerFile = 10000
+
+    # Sentences are drawn from a pool, generating each one is slow
+    poolSize = 5000
+
+    # The newest message in every export, so runs are repeatable
+    endTime = 1590969600000  # 01/06/2020
+
+    def make_export(self, zipLoc, myName, contacts=50, messages=20000,
+                    years=5, groupRatio=0.1, seed=0):
+        # Writes a zip of contacts one to one threads, plus group chats
+        # making up groupRatio of all threads, sharing the messages
+        random.seed(seed)
+
+        people = self.make_names(contacts)
+        sentences = self.make_sentences()
+
+        groups = int(round(contacts * groupRatio / (1 - groupRatio)))
+        threads = self.make_threads(myName, people, groups)
+        counts = self.split_messages(messages, len(threads))
+
+        startTime = self.endTime - int(years * 365.25 * 86400000)
+
+        Path(os.path.dirname(zipLoc)).mkdir(parents=True, exist_ok=True)
+
+        print("Generating %s threads with %s messages..." %
+              (len(threads), messages))
+
+        with ZipFile(zipLoc, "w", ZIP_DEFLATED) as zipFile:
+            for thread, count in tqdm(list(zip(threads, counts))):
+                threadMessages = self.make_messages(
+                    thread, count, startTime, sentences)
+                self.write_thread(zipFile, thread, threadMessages)
+
+    def make_names(self, count):
+        people = []
+        seen = set()
+        while len(people) < count:
+            name = names.get_full_name()
+            if name not in seen:
+                seen.add(name)
+                people.append(name)
+
+        return people
+
+    def make_sentences(self):
+        gen = DocumentGenerator()
+        sentences = []
+        for i in range(self.poolSize):
+            sentence = gen.sentence()
+            # Some messages have emoji and accents, like real ones
+            if random.random() < 0.1:
+                sentence += random.choice([" 😂", " 👍", " ❤", " café"])
+            sentences.append(sentence)
+
+        return sentences
+
+    def make_threads(self, myName, people, groups):
+        threads = []
+        for person in people:
+            threads.append({
+                "title": person,
+                "participants": [person, myName],
+                "threadType": "Regular"
+            })
+
+        for i in range(groups):
+            members = random.sample(people, min(len(people),
+                                                random.randint(2, 8)))
+            threads.append({
+                "title": "Group %s" % (i + 1),
+                "participants": members + [myName],
+                "threadType": "RegularGroup"
+            })
+
+        # A folder name like facebook's, the title and a random id
+        for thread in threads:
+            randID = "".join(random.choices("abcdefg12345", k=10))
+            thread['contactID'] = thread['title'].replace(" ", "") + \
+                "_" + randID
+
+        random.shuffle(threads)
+
+        return threads
+
+    def split_messages(self, messages, threadCount):
+        # A few people get most of the messages, like a real inbox
+        weights = [1 / (rank + 1) ** 1.1 for rank in range(threadCount)]
+        total = sum(weights)
+        counts = [int(messages * weight / total) for weight in weights]
+        counts[0] += messages - sum(counts)
+
+        return counts
+
+    def make_messages(self, thread, count, startTime, sentences):
+        # Each thread starts somewhere in the first half of the range and
+        # gets busier towards the end
+        span = self.endTime - startTime
+        threadStart = startTime + int(random.random() * span * 0.5)
+        threadSpan = self.endTime - threadStart
+
+        times = sorted(
+            threadStart + int(random.random() ** 1.5 * threadSpan)
+            for i in range(count))
+
+        messages = []
+        for timestamp in times:
+            message = {
+                "sender_name": random.choice(thread['participants']),
+                "timestamp_ms": timestamp
+            }
+
+            # Some messages are photos, with no text
+            if random.random() < 0.03:
+                message['photos'] = [{"uri": "messages/photos/1.jpg"}]
+            else:
+                message['content'] = random.choice(sentences)
+            message['type'] = "Generic"
+
+            messages.append(message)
+
+        # Newest first, like the real export
+        messages.reverse()
+
+        return messages
+
+    def write_thread(self, zipFile, thread, messages):
+        folder = "messages/inbox/" + thread['contactID'] + "/"
+
+        for fileNum, start in enumerate(
+                range(0, max(len(messages), 1), self.messagesPerFile)):
+            messageFile = {
+                "participants": [
+                    {"name": name} for name in thread['participants']],
+                "messages": messages[start:start + self.messagesPerFile],
+                "title": thread['title'],
+                "is_still_participant": True,
+                "thread_type": thread['threadType'],
+                "thread_path": "inbox/" + thread['contactID']
+            }
+
+            # Facebook writes each utf-8 byte as its own latin-1 char
+            text = json.dumps(messageFile, ensure_ascii=False)
+            zipFile.writestr(
+                folder + "message_%s.json" % (fileNum + 1),
+                text.encode('utf-8').decode('latin-1'))
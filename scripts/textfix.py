@@ -0,0 +1,53 @@
+###################################
+# textfix.py
+###################################
+"""
+Author: Matt Balshaw
+Start Date: 18/10/2026
+
+Fixes the broken unicode in facebook exports
+Facebook writes each utf-8 byte as its own latin-1 character, so most
+text is fixed by encoding back to latin-1 and decoding as utf-8
+ftfy is only used for text that can't be fixed that way or still looks
+broken afterwards
+"""
+
+import re
+import ftfy
+from functools import lru_cache
+
+
+# A utf-8 lead byte followed by a continuation byte, as latin-1
+# Left in fixed text this means it was double encoded
+mojibakePattern = re.compile('[Â-ô][\u0080-¿]')
+
+# Names and short replies repeat a lot, so remember their fixes
+shortText = 64
+
+
+def fix_text(text):
+    # Plain ascii text is never broken
+    if text.isascii():
+        return text
+
+    if len(text) <= shortText:
+        return fix_cached(text)
+
+    return fix_broken(text)
+
+
+@lru_cache(maxsize=1 << 16)
+def fix_cached(text):
+    return fix_broken(text)
+
+
+def fix_broken(text):
+    try:
+        fixed = text.encode('latin-1').decode('utf-8')
+    except UnicodeError:
+        return ftfy.fix_text(text)
+
+    if mojibakePattern.search(fixed):
+        return ftfy.fix_text(text)
+
+    return fixed
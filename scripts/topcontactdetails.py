@@ -9,102 +9,72 @@ Outputs graphs about the top contacts
 """
 
 import pandas as pd
-import os
-import matplotlib.pyplot as plt
+import numpy as np
 import matplotlib.ticker as ticker
+from matplotlib.figure import Figure
 
-import sys
+import time
 from tqdm import tqdm
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from scripts.dataset import ProcessedDataset
+from scripts.stagecache import StageCacheFuncs
+from scripts import instrument
 
 
 class TopContactDetails():
 
-    def generate_all_graphs(self, config):
+    # Every metric can be worked out from the daily totals
+    stage = "topContactDetails"
+    title = "Top Contact Details"
+    tables = {
+        "cube": ['contactID', 'name', 'isGroup', 'received', 'msgs',
+                 'chars', 'maxChars', 'convStarts']
+    }
+
+    def run(self, config, dataset):
+        self.generate_all_graphs(config, dataset)
+
+    def generate_all_graphs(self, config, dataset=None):
 
-        # Checks that we have the allMessagesData
+        if dataset is None:
+            dataset = ProcessedDataset(config)
 
-        processedLoc = "processed-data/" + config['zipFile'] + "/"
-        outpotLoc = "output-data/" + config['zipFile'] + "/"
+        # Checks that we have the processed data
+        dataset.check()
+
+        outpotLoc = dataset.outputLoc
 
         Path(outpotLoc).mkdir(parents=True, exist_ok=True)
 
-        allMsgLoc = processedLoc + "allMessageData.csv"
         outputFilePath = outpotLoc + "topContactMetrics.csv"
 
-        if not os.path.exists(allMsgLoc):
-            print("Can't find the allMessageData.csv")
-            print("☠ Critical error, exiting...")
-            sys.exit()
+        # Rerun when the processed messages or our config have changed
+        cache = StageCacheFuncs(config)
+        stageKey = cache.stage_key(
+            dataset.input_locs(self.tables), config['topContactDetails'])
 
-        if os.path.exists(outputFilePath) and not config['debug']:
-            print("♻ Found existing sendreceivecontacts.csv")
+        if cache.is_fresh('topContactDetails', stageKey, [outputFilePath]) \
+                and not config['debug']:
+            print("♻ Found existing topContactMetrics.csv")
             return True
 
         print("Calculating our top contact data...")
 
-        allMessages = pd.read_csv(allMsgLoc)
-
-        # Get characters of each message
-        allMessages['len'] = allMessages.apply(
-            lambda row: len(row.content), axis=1)
-
-        # Calculate average length of messages
-        allMessages['averageLen'] = allMessages.groupby(
-            ['name'])['len'].transform('mean')
-
-        # Count length of messages received and sent
-        allMessages['partLen'] = allMessages.groupby(['name', 'received'])[
-            'len'].transform('sum')
-
-        # Calculate total length of messages
-        allMessages['totalLen'] = allMessages.groupby(
-            ['name'])['len'].transform('sum')
-
-        # Calculate total messages
-        allMessages['msg'] = 1
-        allMessages['totalMsgs'] = allMessages.groupby(
-            ['name'])['msg'].transform('sum')
+        with instrument.step("metrics"):
+            allMessages = dataset.get("cube", self.tables['cube'])
+            instrument.add_rows(len(allMessages))
 
-        # Calculate longest message
-        allMessages['longestMsg'] = allMessages.groupby(['name'])[
-            'len'].transform('max')
+            # Group chats are left out unless asked for
+            if not config['topContactDetails'].get(
+                    'includeGroupChats', False):
+                allMessages = allMessages[~allMessages['isGroup']]
 
-        print("Calculating conversation metrics")
-
-        # Calculate total conv starts
-        allMessages['convsTheyStarted'] = allMessages.groupby(
-            ['name', 'received'])['startedConv'].transform('sum')
-        allMessages['totalConvs'] = allMessages.groupby(
-            ['name'])['startedConv'].transform('sum')
-
-        #######################################################
-        # Drop all duplicates to speed up following calculations
-        allMessages = allMessages.drop_duplicates(
-            subset=['name', 'received'])
-
-        #######################################################
-
-        # Ignore all the sent messages
-        allMessages = allMessages[allMessages['received'] == 1]
-
-        # Calculate percentage of messages that were received
-        allMessages['pctReceived'] = allMessages.apply(
-            lambda row: (row.partLen / row.totalLen), axis=1)
-
-        # Calculate messages per conversation
-        allMessages['msgsPerConv'] = allMessages.apply(
-            lambda row: (row.totalMsgs / row.totalConvs), axis=1)
+            allMessages = self.compute_metrics(allMessages)
 
-        # Calculate percentage of conversations they started
-        allMessages['pctStarted'] = allMessages.apply(
-            lambda row: (row.convsTheyStarted / row.totalConvs), axis=1)
         print("Saving raw data")
 
-        # Drop intermediary cols
-        allMessages = allMessages.drop(
-            columns=["Unnamed: 0", "received", "startedConv", "content", "type", "timestamp_ms", "len"])
-
         # Sort by total chars sent and received
         allMessages = allMessages.sort_values(
             by=['totalLen'], ascending=False)
@@ -115,6 +85,11 @@ class TopContactDetails():
         # Format for graphs
         numContacts = config['topContactDetails']['maxFriendsShown']
 
+        # Charts are saved as svg, or as png which is quicker for lots
+        chartFormat = config['topContactDetails'].get('chartFormat', 'svg')
+        chartDpi = config['topContactDetails'].get('chartDpi', 100)
+        charts = []
+
         graphData = allMessages.head(numContacts).copy()
 
         # Format rows
@@ -148,13 +123,13 @@ class TopContactDetails():
             'xaxis': 'pctReceived',
             'yaxis': 'name',
             "units": "%",
-            "saveFile": outpotLoc + "topContactsReceivedPercentage.svg",
+            "saveFile": outpotLoc + "topContactsReceivedPercentage." + chartFormat,
             "width": config['topContactDetails']['width'],
-            "height": config['topContactDetails']['height']
-
+            "height": config['topContactDetails']['height'],
+            "dpi": chartDpi
         }
 
-        self.make_graph(graphData, graphConfig)
+        charts.append((graphData, graphConfig))
 
         ################
         # Do the average length graph
@@ -168,12 +143,13 @@ class TopContactDetails():
             "xaxis": "averageLen",
             "yaxis": "name",
             "units": " chars",
-            "saveFile": outpotLoc + "topContactsAverageMessageLength.svg",
+            "saveFile": outpotLoc + "topContactsAverageMessageLength." + chartFormat,
             "width": config['topContactDetails']['width'],
-            "height": config['topContactDetails']['height']
+            "height": config['topContactDetails']['height'],
+            "dpi": chartDpi
         }
 
-        self.make_graph(graphData, graphConfig)
+        charts.append((graphData, graphConfig))
 
         ################
         # Do the conversations started graph
@@ -187,12 +163,13 @@ class TopContactDetails():
             "xaxis": "pctStarted",
             "yaxis": "name",
             "units": "%",
-            "saveFile": outpotLoc + "topContactsConversationsStarted.svg",
+            "saveFile": outpotLoc + "topContactsConversationsStarted." + chartFormat,
             "width": config['topContactDetails']['width'],
-            "height": config['topContactDetails']['height']
+            "height": config['topContactDetails']['height'],
+            "dpi": chartDpi
         }
 
-        self.make_graph(graphData, graphConfig)
+        charts.append((graphData, graphConfig))
 
         ################
         # Do the messages per conversation
@@ -206,21 +183,103 @@ class TopContactDetails():
             "xaxis": "msgsPerConv",
             "yaxis": "name",
             "units": " messages",
-            "saveFile": outpotLoc + "topContactsMessagesPerConversation.svg",
+            "saveFile": outpotLoc + "topContactsMessagesPerConversation." + chartFormat,
             "width": config['topContactDetails']['width'],
-            "height": config['topContactDetails']['height']
+            "height": config['topContactDetails']['height'],
+            "dpi": chartDpi
         }
 
-        self.make_graph(graphData, graphConfig)
+        charts.append((graphData, graphConfig))
         #######################################################
+        self.render_charts(
+            charts, config['topContactDetails'].get('chartWorkers', 1))
+
+        cache.record('topContactDetails', stageKey)
         print("✓ Top contacts data Graphed")
 
+    def compute_metrics(self, cubeDF):
+        # Computes every per contact metric in one grouped pass over the
+        # daily cube
+        # Received-only sums are done on columns zeroed for sent rows
+        received = cubeDF['received'].to_numpy(dtype=bool)
+
+        rows = pd.DataFrame({
+            "name": cubeDF['name'],
+            "msgs": cubeDF['msgs'].astype('int64'),
+            "chars": cubeDF['chars'].astype('int64'),
+            "receivedChars": cubeDF['chars'].where(received, 0),
+            "maxChars": cubeDF['maxChars'],
+            "convStarts": cubeDF['convStarts'],
+            "receivedStarts": cubeDF['convStarts'].where(received, 0),
+            "received": received,
+            # Position of each received row, used to find the first
+            "receivedRow": np.where(
+                received, np.arange(len(cubeDF)), len(cubeDF))
+        })
+
+        metrics = rows.groupby('name', observed=True, sort=False).agg(
+            partLen=('receivedChars', 'sum'),
+            totalLen=('chars', 'sum'),
+            totalMsgs=('msgs', 'sum'),
+            longestMsg=('maxChars', 'max'),
+            convsTheyStarted=('receivedStarts', 'sum'),
+            totalConvs=('convStarts', 'sum'),
+            anyReceived=('received', 'any'),
+            firstReceived=('receivedRow', 'min')
+        )
+
+        # Ignore contacts who never sent me anything
+        metrics = metrics[metrics['anyReceived']].reset_index()
+
+        # Take the contactID of their first message to me
+        metrics.insert(
+            0, 'contactID',
+            cubeDF['contactID'].to_numpy()[metrics['firstReceived']])
+
+        # Calculate average length of messages
+        metrics.insert(
+            2, 'averageLen', metrics['totalLen'] / metrics['totalMsgs'])
+        metrics.insert(5, 'msg', 1)
+
+        # Calculate percentage of messages that were received
+        metrics['pctReceived'] = metrics['partLen'] / metrics['totalLen']
+
+        # Calculate messages per conversation
+        metrics['msgsPerConv'] = metrics['totalMsgs'] / metrics['totalConvs']
+
+        # Calculate percentage of conversations they started
+        metrics['pctStarted'] = \
+            metrics['convsTheyStarted'] / metrics['totalConvs']
+
+        return metrics.drop(columns=['anyReceived', 'firstReceived'])
+
+    def render_charts(self, charts, workers):
+        # Each chart is drawn on its own figure, so they can be drawn by
+        # separate worker processes
+        if workers <= 1:
+            for graphData, graphConfig in charts:
+                self.make_graph(graphData, graphConfig)
+            return
+
+        print("Drawing %s charts with %s worker processes" %
+              (len(charts), workers))
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for timings in executor.map(
+                    render_chart,
+                    [graphData for graphData, graphConfig in charts],
+                    [graphConfig for graphData, graphConfig in charts],
+                    [instrument.enabled] * len(charts)):
+                instrument.merge_timings(timings)
+
     def make_graph(self, graphData, graphConfig):
+        chartStart = time.perf_counter()
 
         # Plot the graph
-
-        fig, ax = plt.subplots(
-            figsize=(graphConfig['width'], graphConfig['height']))
+        # A figure made without pyplot is freed as soon as we are done
+        # with it, rather than being kept open by pyplot
+        fig = Figure(figsize=(graphConfig['width'], graphConfig['height']))
+        ax = fig.subplots()
 
         # Create bar graph
         ax.barh(
@@ -282,7 +341,16 @@ class TopContactDetails():
         ax.grid(which='major', axis='x', linestyle='-')
         ax.set_axisbelow(True)
 
-        plt.box(False)
-        plt.tight_layout(h_pad=3)
+        ax.set_frame_on(False)
+        fig.tight_layout(h_pad=3)
+
+        fig.savefig(graphConfig['saveFile'], dpi=graphConfig.get('dpi'))
+        instrument.add_time("chart", time.perf_counter() - chartStart, rows=1)
+
 
-        plt.savefig(graphConfig['saveFile'])
+def render_chart(graphData, graphConfig, instrumented):
+    # Draws one chart in a worker, sending back its timings
+    instrument.enabled = instrumented
+    instrument.take_timings()
+    TopContactDetails().make_graph(graphData, graphConfig)
+    return instrument.take_timings()
@@ -10,9 +10,14 @@ Unzips the facebook messenger download file
 
 from zipfile import ZipFile
 from tqdm import tqdm
+import hashlib
 import os
+import re
+import shutil
 import sys
 
+from scripts.stagecache import StageCacheFuncs
+
 
 class ZipFuncs():
 
@@ -20,11 +25,21 @@ class ZipFuncs():
         loc = "facebook-zips/" + config['zipFile'] + ".zip"
         dest = "raw-data/" + config['zipFile']
 
+        cache = StageCacheFuncs(config)
+        stageKey = cache.stage_key(
+            [], {"zipFile": config['zipFile']},
+            {loc: self.fingerprint_zip(loc)})
+
         # Check if file exists
         doesExist, errorMessage = self.check_exists(dest)
         if not doesExist or config['debug']:
             print(errorMessage)
             self.unzip_file(loc, dest)
+        elif not cache.is_fresh('unzip', stageKey):
+            print("Zip file has changed, extracting again")
+            # Clear the old extract so removed conversations don't linger
+            shutil.rmtree(dest)
+            self.unzip_file(loc, dest)
         else:
             print("♻ Using existing raw data")
 
@@ -35,8 +50,70 @@ class ZipFuncs():
             print("☠ Critical error, exiting...")
             sys.exit()
         else:
+            cache.record('unzip', stageKey)
             print("✓ Unzip success")
 
+    def run_stream_check(self, config):
+        loc = "facebook-zips/" + config['zipFile'] + ".zip"
+
+        # Streaming reads straight from the zip, so only validate it
+        doesExist, errorMessage = self.check_zip(loc)
+
+        if not doesExist:
+            print(errorMessage)
+            print("☠ Critical error, exiting...")
+            sys.exit()
+        else:
+            print("✓ Streaming messages from %s" % loc)
+
+    def check_zip(self, loc):
+        # Ensure that the zip exists and contains an inbox
+        if not os.path.exists(loc):
+            return False, "No zip file found at %s" % loc
+
+        if len(self.list_message_files(loc)) == 0:
+            return False, "Invalid zip file used, ensure the zip used was downloaded from Facebook"
+
+        return True, "Found zip file"
+
+    def list_message_files(self, loc):
+        # Find each conversation json in the zip without extracting anything
+        # Matches messages/inbox/<contactID>/<file>.json only, so photos,
+        # videos and audio in the export are never read
+        p = re.compile('^messages/inbox/([^/]+)/[^/]+\\.json$')
+
+        messageFiles = []
+        with ZipFile(file=loc) as zip_file:
+            for info in zip_file.infolist():
+                match = p.match(info.filename)
+                if match:
+                    # The zip already stores a checksum of every member
+                    # which is used to spot changed conversations
+                    msgFile = {
+                        "path": info.filename,
+                        "contactID": match.group(1),
+                        "zipFile": loc,
+                        "size": info.file_size,
+                        "hash": "crc32:%08x" % info.CRC
+                    }
+                    messageFiles.append(msgFile)
+
+        return messageFiles
+
+    def fingerprint_zip(self, loc):
+        # Hash the size and checksum of every conversation, which the zip
+        # stores in its directory, so photos and videos are never read
+        if not os.path.exists(loc):
+            return None
+
+        sha = hashlib.sha1()
+        for msgFile in self.list_message_files(loc):
+            sha.update(("%s %s %s\n" % (
+                msgFile['path'], msgFile['size'], msgFile['hash'])
+            ).encode("utf-8"))
+
+        return sha.hexdigest()
+
     def check_exists(self, loc):
         # Ensure that the directory exists and is correct
         inboxLoc = loc + "/messages/inbox"
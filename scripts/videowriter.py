@@ -0,0 +1,111 @@
+###################################
+# videowriter.py
+###################################
+"""
+Author: Matt Balshaw
+Start Date: 18/10/2026
+
+Pipes raw RGBA frames into a single ffmpeg process to encode a video
+Frames can be any buffer, like a view of the canvas, so nothing is copied
+or encoded on the way to ffmpeg
+GifWriter uses the same pipe to make short looping gifs for previews
+"""
+
+import subprocess
+import tempfile
+import time
+import matplotlib
+
+from scripts import instrument
+
+
+class FFmpegWriter():
+
+    # Encoder settings used when the config doesn't give them
+    codec = 'h264'
+    crf = 23
+    preset = 'medium'
+
+    # Software only, so it works everywhere, just with bigger files
+    fastPreset = 'ultrafast'
+
+    def __init__(self, outputFile, width, height, fps, codec=None, crf=None,
+                 preset=None):
+        self.outputFile = outputFile
+
+        command = [
+            matplotlib.rcParams['animation.ffmpeg_path'],
+            '-y',
+            '-f', 'rawvideo',
+            '-vcodec', 'rawvideo',
+            '-s', '%dx%d' % (width, height),
+            '-pix_fmt', 'rgba',
+            '-r', str(fps),
+            '-loglevel', 'error',
+            '-i', 'pipe:'
+        ] + self.encode_args(codec, crf, preset) + [outputFile]
+
+        # ffmpeg's errors go to a file rather than a pipe, so they can't
+        # fill up and stall it, and are read back if it fails
+        self.errors = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(
+            command, stdin=subprocess.PIPE, stderr=self.errors)
+
+    def encode_args(self, codec, crf, preset):
+        # yuv420p needs an even width and height, so odd sized frames get
+        # a white pixel of padding, as matplotlib's writer rounds them up
+        return [
+            '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2:color=white',
+            '-vcodec', codec or self.codec,
+            '-crf', str(self.crf if crf is None else crf),
+            '-preset', preset or self.preset,
+            '-pix_fmt', 'yuv420p'
+        ]
+
+    def write(self, frameBytes):
+        # Time blocked here is time waiting on the encoder
+        writeStart = time.perf_counter()
+        try:
+            self.process.stdin.write(frameBytes)
+        except BrokenPipeError:
+            # ffmpeg has stopped reading, so it has already failed
+            self.fail()
+        instrument.add_time("encode", time.perf_counter() - writeStart,
+                            rows=1, size=memoryview(frameBytes).nbytes)
+
+    def close(self):
+        closeStart = time.perf_counter()
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            self.fail()
+        returnCode = self.process.wait()
+        instrument.add_time("encode", time.perf_counter() - closeStart)
+        if returnCode != 0:
+            self.fail()
+        self.errors.close()
+
+    def fail(self):
+        # Raise with what ffmpeg said went wrong
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.process.wait()
+
+        self.errors.seek(0)
+        message = self.errors.read().decode('utf-8', 'replace').strip()
+        self.errors.close()
+
+        raise RuntimeError("ffmpeg failed to write %s:\n%s" %
+                           (self.outputFile, message))
+
+
+class GifWriter(FFmpegWriter):
+
+    def encode_args(self, codec, crf, preset):
+        # Build a palette from the frames so the colours stay accurate
+        return [
+            '-vf', 'split[a][b];[a]palettegen[p];[b][p]paletteuse',
+            '-loop', '0'
+        ]